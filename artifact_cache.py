@@ -0,0 +1,202 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+CACHE_ROOT = "processed_data/.cache"
+# Bumped when a stage's output changes for the same inputs, so every artifact is rebuilt
+CACHE_VERSION = 1
+CACHE_MAX_BYTES = 100 * 1024**3
+CACHE_MAX_AGE_DAYS = 30
+# Set to 0 to build everything from scratch, like the benchmarks do. Worker processes inherit it.
+CACHE_ENV = "SHORTS_CACHE"
+
+
+class ArtifactCache:
+    """
+    Build cache for the pipeline's outputs. Every artifact is keyed by a hash of its kind, parameters
+    and input files, so changing any of them rebuilds it, and nothing else.
+    The manifest records every artifact and is shared by threads and processes through a file lock.
+    A stored artifact is hard linked into objects/, so the working copy costs no extra disk. Producers
+    must not write through that link: fetch unlinks the working copy on a miss, and an object whose size
+    or mtime changed since it was stored is treated as a miss.
+    Artifacts unused for max_age_days are evicted, then the least recently used until the cache fits max_bytes.
+    Eviction only removes the cache's own link, the working copy is only deleted for artifacts stored
+    as regenerable, like source downloads, so deliverables and paid for LLM output are never touched.
+    """
+    def __init__(self, root: str = CACHE_ROOT, max_bytes: int = CACHE_MAX_BYTES, max_age_days: float = CACHE_MAX_AGE_DAYS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.objects_dir = os.path.join(root, "objects")
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self.enabled = os.getenv(CACHE_ENV) != "0"
+
+    def disable(self) -> None:
+        self.enabled = False
+        os.environ[CACHE_ENV] = "0"
+
+    @contextmanager
+    def _manifest(self):
+        os.makedirs(self.objects_dir, exist_ok=True)
+        with open(os.path.join(self.root, "manifest.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                manifest = {"artifacts": {}, "files": {}}
+                if os.path.exists(self.manifest_path):
+                    with open(self.manifest_path, "r", encoding="utf-8") as file:
+                        manifest = json.load(file)
+
+                yield manifest
+
+                temp_path = self.manifest_path + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as file:
+                    json.dump(manifest, file, indent=1)
+                os.replace(temp_path, self.manifest_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _file_state(path: str) -> dict:
+        stat = os.stat(path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def fingerprint(self, path: str) -> str:
+        """
+        Content hash of an input file. Files the cache produced are identified by their key and
+        hashes are remembered per (size, mtime), so a multi-GB source is read at most once.
+        """
+        path = os.path.abspath(path)
+        state = self._file_state(path)
+        with self._manifest() as manifest:
+            known = manifest["files"].get(path)
+            if known is not None and all(known[name] == value for name, value in state.items()):
+                return known["fingerprint"]
+
+        with open(path, "rb") as file:
+            fingerprint = hashlib.file_digest(file, "sha256").hexdigest()
+
+        with self._manifest() as manifest:
+            manifest["files"][path] = {**state, "fingerprint": fingerprint}
+        return fingerprint
+
+    def key(self, kind: str, params: Optional[dict] = None, inputs: Iterable[str] = ()) -> str:
+        if not self.enabled:
+            # Nothing will be looked up, don't hash the inputs
+            return ""
+        description = {
+            "version": CACHE_VERSION,
+            "kind": kind,
+            "params": params or {},
+            "inputs": [self.fingerprint(path) for path in inputs],
+        }
+        # Dataclass settings hash by their repr
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=repr).encode()).hexdigest()
+
+    def _object_path(self, key: str, output_path: str) -> str:
+        return os.path.join(self.objects_dir, key + os.path.splitext(output_path)[1])
+
+    @staticmethod
+    def _link(source: str, destination: str) -> None:
+        temp_path = destination + ".tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            # Other filesystem, or no hard links
+            shutil.copy2(source, temp_path)
+        os.replace(temp_path, destination)
+
+    def fetch(self, key: str, output_path: str) -> bool:
+        """
+        Puts the artifact for key at output_path and returns True, if it is cached. Otherwise removes
+        whatever stale file is at output_path, so it is rebuilt rather than written through the hard link.
+        """
+        if not self.enabled:
+            # A working copy from an earlier cached run may still share its inode with an object
+            if os.path.exists(output_path) and os.stat(output_path).st_nlink > 1:
+                os.remove(output_path)
+            return False
+        with self._manifest() as manifest:
+            entry = manifest["artifacts"].get(key)
+            object_path = self._object_path(key, output_path)
+            # Objects stored before the state was recorded are trusted
+            state = entry.get("state") if entry is not None else None
+            if state is not None and os.path.exists(object_path) and self._file_state(object_path) != state:
+                print(f"Cached artifact {entry['path']} was modified after it was stored, rebuilding it")
+                os.remove(object_path)
+            if entry is None or not os.path.exists(object_path):
+                manifest["artifacts"].pop(key, None)
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                return False
+
+            if not os.path.exists(output_path) or not os.path.samefile(object_path, output_path):
+                os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+                self._link(object_path, output_path)
+
+            entry["last_used"] = time.time()
+            entry["path"] = os.path.abspath(output_path)
+            manifest["files"][os.path.abspath(output_path)] = {**self._file_state(output_path), "fingerprint": key}
+            return True
+
+    def store(self, key: str, output_path: str, regenerable: bool = False) -> str:
+        """
+        Records output_path as the artifact for key, then evicts what no longer fits. Returns output_path.
+        regenerable lets eviction delete output_path too, for large intermediates that can always be fetched again.
+        """
+        if not self.enabled:
+            return output_path
+        with self._manifest() as manifest:
+            object_path = self._object_path(key, output_path)
+            self._link(output_path, object_path)
+            now = time.time()
+            manifest["artifacts"][key] = {
+                "path": os.path.abspath(output_path),
+                "size": os.path.getsize(output_path),
+                "state": self._file_state(object_path),
+                "regenerable": regenerable,
+                "created": now,
+                "last_used": now,
+            }
+            manifest["files"][os.path.abspath(output_path)] = {**self._file_state(output_path), "fingerprint": key}
+            self._evict(manifest, keep=key)
+        return output_path
+
+    def _remove(self, manifest: dict, key: str) -> None:
+        entry = manifest["artifacts"].pop(key)
+        object_path = self._object_path(key, entry["path"])
+        # A regenerable working copy only goes with it while it is still the cached file, that is what frees the disk
+        if entry.get("regenerable") and os.path.exists(entry["path"]) and os.path.exists(object_path) and os.path.samefile(entry["path"], object_path):
+            os.remove(entry["path"])
+            manifest["files"].pop(entry["path"], None)
+        if os.path.exists(object_path):
+            os.remove(object_path)
+        print(f"Evicted cached artifact {entry['path']}")
+
+    def _evict(self, manifest: dict, keep: Optional[str] = None) -> None:
+        artifacts = manifest["artifacts"]
+        oldest = time.time() - self.max_age_days * 24 * 60 * 60
+        for key in [key for key, entry in artifacts.items() if entry["last_used"] < oldest and key != keep]:
+            self._remove(manifest, key)
+
+        total = sum(entry["size"] for entry in artifacts.values())
+        for key in sorted(artifacts, key=lambda key: artifacts[key]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= artifacts[key]["size"]
+            self._remove(manifest, key)
+
+    def evict(self) -> None:
+        with self._manifest() as manifest:
+            self._evict(manifest)
+
+
+artifact_cache = ArtifactCache()
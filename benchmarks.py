@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+import ffmpeg
+from artifact_cache import artifact_cache
+from clip_new import clip_mode, clip_video
+from constants import ROOT_RESULTS_FOLDER
+from csv_utils import CSVUtils
+from make_shorts import Subtitles, VideoEditor
+from utils import TimeMap, merge_intervals
+
+BENCHMARK_RESULTS_FOLDER = ROOT_RESULTS_FOLDER + "/benchmarks"
+BENCHMARKS = ["lookup", "offset", "render", "clip", "news"]
+BENCHMARK_SIZES = ["1920x1080", "3840x2160"]
+# --quick runs everything on small inputs, to check the suite works rather than to compare numbers
+QUICK_SIZES = ["854x480"]
+# Multiplier on the cue rate, from a slow monologue to fast cross talk
+TRANSCRIPT_DENSITIES = [0.5, 1, 2]
+FONT_PATH = "fonts/komika-axis/KOMIKAX_.ttf"
+
+
+def make_synthetic_transcript(output_file: str, duration_ms: int, seed: int = 0, density: float = 1.0):
+    """
+    YouTube style cues: a new line every 2-4 s, each on screen for 2-6 s so neighbours overlap.
+    density divides the time between lines, 2 gives twice as many cues.
+    """
+    rng = random.Random(seed)
+    rows = []
+    start_ms = 0
+    while start_ms < duration_ms:
+        rows.append({
+            "text": f"line {len(rows)}",
+            "startMs": start_ms,
+            "endMs": start_ms + rng.randint(2000, 6000)
+        })
+        start_ms += int(rng.randint(2000, 4000) / density)
+
+    return CSVUtils.write_subtitles_to_csv(output_file, rows)
+
+def _linear_lookup(subtitles: Subtitles, timestamp_ms: int):
+    # The scan Subtitles.get_subtitles_at_time used before the index
+    return [entry for entry in subtitles.entries if entry.start_ms <= timestamp_ms <= entry.end_ms]
+
+def benchmark_subtitle_lookup(hours: float = 3, fps: float = 30, sampled_frames: int = 3000, density: float = 1.0):
+    duration_ms = int(hours * 3600 * 1000)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        subtitles = Subtitles(make_synthetic_transcript(os.path.join(tmp_dir, "subtitles.csv"), duration_ms, density=density))
+
+    # A run of consecutive frames from the middle of the episode
+    first_frame = int(duration_ms / 2 / 1000 * fps)
+    timestamps = [int((frame_number / fps) * 1000) for frame_number in range(first_frame, first_frame + sampled_frames)]
+
+    start = time.perf_counter()
+    linear = [_linear_lookup(subtitles, t) for t in timestamps]
+    linear_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = [subtitles.get_subtitles_at_time(t) for t in timestamps]
+    indexed_s = time.perf_counter() - start
+
+    cursor = subtitles.cursor()
+    start = time.perf_counter()
+    sequential = [cursor.at(t) for t in timestamps]
+    cursor_s = time.perf_counter() - start
+
+    assert linear == indexed == sequential
+
+    results = {
+        "density": density,
+        "cues": len(subtitles.entries),
+        "lookups": len(timestamps),
+        "linear_us_per_lookup": linear_s / len(timestamps) * 1e6,
+        "indexed_us_per_lookup": indexed_s / len(timestamps) * 1e6,
+        "cursor_us_per_lookup": cursor_s / len(timestamps) * 1e6,
+    }
+    print(f"Subtitle lookup on a {hours}h transcript ({results['cues']} cues, {results['lookups']} frames)")
+    for name in ["linear", "indexed", "cursor"]:
+        print(f"  {name:8s} {results[name + '_us_per_lookup']:10.2f} us/lookup")
+
+    return results
+
+def benchmark_subtitle_offset(hours: float = 3, densities=TRANSCRIPT_DENSITIES, story_count: int = 20, story_ms: int = 60000):
+    """
+    Time CSVUtils.offset_csv_file_timestamps on a whole transcript, with the gap heuristic and through a TimeMap
+    of story_count stories spread over the episode.
+    """
+    duration_ms = int(hours * 3600 * 1000)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for density in densities:
+            csv_file = make_synthetic_transcript(os.path.join(tmp_dir, f"subtitles_{density}.csv"), duration_ms, density=density)
+            rows = CSVUtils.get_subtitles_as_dict(csv_file)
+
+            spacing_ms = duration_ms // story_count
+            kept = [(row["startMs"], row["endMs"]) for row in rows if row["startMs"] % spacing_ms < story_ms]
+            time_map = TimeMap(merge_intervals(kept))
+
+            start = time.perf_counter()
+            CSVUtils.offset_csv_file_timestamps(csv_file)
+            gaps_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            CSVUtils.offset_csv_file_timestamps(csv_file, time_map)
+            time_map_s = time.perf_counter() - start
+
+            results.append({"density": density, "cues": len(rows), "gaps_seconds": gaps_s, "time_map_seconds": time_map_s})
+
+    print(f"Subtitle offset on a {hours}h transcript")
+    for result in results:
+        print(f"  density {result['density']:4}  {result['cues']:6d} cues  gaps {result['gaps_seconds'] * 1000:8.2f} ms  time map {result['time_map_seconds'] * 1000:8.2f} ms")
+
+    return results
+
+def make_synthetic_video(output_file: str, duration_s: int, size: str = "1920x1080", fps: int = 30):
+    """testsrc2 picture with a sine tone, encoded like a YouTube download (h264 with a keyframe every 2 s, aac)."""
+    video = ffmpeg.input(f"testsrc2=size={size}:rate={fps}:duration={duration_s}", f="lavfi")
+    audio = ffmpeg.input(f"sine=frequency=440:duration={duration_s}", f="lavfi")
+    stream = ffmpeg.output(video, audio, output_file, vcodec="libx264", preset="veryfast", g=fps * 2, pix_fmt="yuv420p", acodec="aac")
+    ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
+    return output_file
+
+def benchmark_render(sizes=BENCHMARK_SIZES, duration_s: int = 5, render_modes=("pipe", "filtergraph"), prescale: str = "lanczos", font_path: str = FONT_PATH):
+    """Frames per second of VideoEditor.process_video on a captioned clip, per source resolution and render mode."""
+    fps = 30
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        subtitles = Subtitles(make_synthetic_transcript(os.path.join(tmp_dir, "subtitles.csv"), duration_s * 1000))
+        for size in sizes:
+            source = make_synthetic_video(os.path.join(tmp_dir, f"source_{size}.mp4"), duration_s, size, fps)
+            for render_mode in render_modes:
+                output = os.path.join(tmp_dir, f"render_{size}_{render_mode}.mp4")
+                editor = VideoEditor(tmp_dir, source, output, subtitles, font_path=font_path, render_mode=render_mode, prescale=prescale)
+                start = time.perf_counter()
+                editor.process_video()
+                seconds = time.perf_counter() - start
+                frames = duration_s * fps
+                results.append({"size": size, "render_mode": render_mode, "prescale": prescale, "frames": frames, "seconds": seconds, "fps": frames / seconds})
+
+    print(f"VideoEditor.process_video on {duration_s} s clips")
+    for result in results:
+        print(f"  {result['size']:10s} {result['render_mode']:12s} {result['fps']:8.1f} frames/s")
+
+    return results
+
+def benchmark_clip_modes(interval_counts=(5, 100), interval_ms: int = 1500, spacing_ms: int = 3000, size: str = "1920x1080", modes=("copy", "smart", "filter"),
+                         auto_filter: bool = False):
+    """
+    Time clip_video's per segment modes against the single trim/concat process for short, evenly spread intervals.
+    "copy" is only keyframe accurate, "smart" is the frame accurate mode "filter" replaces above FILTER_CUT_MIN_INTERVALS.
+    The switch is off by default, so "smart" runs a smart cut per segment. Every result records the
+    requested mode and the mode that ran.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = make_synthetic_video(os.path.join(tmp_dir, "source.mp4"), max(interval_counts) * spacing_ms // 1000 + 1, size)
+
+        for count in interval_counts:
+            intervals = [(idx * spacing_ms + 500, idx * spacing_ms + 500 + interval_ms) for idx in range(count)]
+            for mode in modes:
+                output = os.path.join(tmp_dir, f"clip_{count}_{mode}.mp4")
+                start = time.perf_counter()
+                clip_video(source, intervals, output, mode=mode, auto_filter=auto_filter)
+                seconds = time.perf_counter() - start
+                results.append({"size": size, "intervals": count, "requested_mode": mode, "mode": clip_mode(mode, count, auto_filter), "seconds": seconds,
+                                "clip_seconds_per_second": count * interval_ms / 1000 / seconds})
+
+    print(f"clip_video on {interval_ms} ms intervals every {spacing_ms} ms of a {size} source")
+    for result in results:
+        ran = result['mode'] if result['mode'] == result['requested_mode'] else f"{result['requested_mode']}->{result['mode']}"
+        print(f"  {result['intervals']:4d} intervals  {ran:14s} {result['seconds']:8.2f} s")
+
+    return results
+
+def benchmark_news_short(story_count: int = 3, story_ms: int = 4000, fps: int = 28, font_path: str = FONT_PATH):
+    """Time the news short's frame generation and encode, on testsrc2 stills and a sine voice over."""
+    import pandas as pd
+    from news_shorts.convert_to_short import create_final_video, create_video_segments
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        contents, timings = [], []
+        for idx in range(story_count):
+            image = os.path.join(tmp_dir, f"{idx}.png")
+            still = ffmpeg.input("testsrc2=size=1280x720:duration=1", f="lavfi")
+            ffmpeg.run(ffmpeg.output(still, image, vframes=1), overwrite_output=True, capture_stdout=True, capture_stderr=True)
+            contents.append({"text": " ".join(f"word{word}" for word in range(60)), "image": image})
+            timings.append({"file": f"{idx}.mp3", "start_time": idx * story_ms, "end_time": (idx + 1) * story_ms})
+
+        audio = os.path.join(tmp_dir, "audio.m4a")
+        voice = ffmpeg.input(f"sine=frequency=220:duration={story_count * story_ms / 1000}", f="lavfi")
+        ffmpeg.run(ffmpeg.output(voice, audio, acodec="aac"), overwrite_output=True, capture_stdout=True, capture_stderr=True)
+
+        frames_dir = os.path.join(tmp_dir, "temp_frames")
+        start = time.perf_counter()
+        frame_paths = create_video_segments({"contents": contents}, pd.DataFrame(timings), fps, font_path, frames_dir)
+        frames_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        create_final_video(frame_paths, audio, os.path.join(tmp_dir, "final_video.mp4"), fps, frames_dir)
+        encode_s = time.perf_counter() - start
+
+    results = {
+        "frames": len(frame_paths),
+        "frames_seconds": frames_s,
+        "encode_seconds": encode_s,
+        "fps": len(frame_paths) / (frames_s + encode_s),
+    }
+    print(f"News short with {story_count} stories of {story_ms} ms at {fps} fps")
+    print(f"  {results['frames']} frames  generate {frames_s:.2f} s  encode {encode_s:.2f} s  {results['fps']:.1f} frames/s")
+
+    return results
+
+def _environment() -> dict:
+    def first_line(cmd):
+        try:
+            return subprocess.run(cmd, capture_output=True, text=True, check=True).stdout.splitlines()[0]
+        except (OSError, subprocess.CalledProcessError, IndexError):
+            return None
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": first_line(["ffmpeg", "-version"]),
+        "commit": first_line(["git", "-C", os.path.dirname(os.path.abspath(__file__)), "rev-parse", "HEAD"]),
+    }
+
+def run_benchmarks(benchmarks=BENCHMARKS, quick: bool = False, font_path: str = FONT_PATH, output_file: str = None) -> str:
+    """
+    Runs the selected benchmarks from scratch, with the artifact cache off, and saves the results with the
+    commit and machine they ran on to output_file, a new timestamped file in BENCHMARK_RESULTS_FOLDER by default.
+    """
+    artifact_cache.disable()
+    sizes = QUICK_SIZES if quick else BENCHMARK_SIZES
+    started = datetime.now()
+    results = {"started": started.isoformat(timespec="seconds"), "quick": quick, "environment": _environment(), "benchmarks": {}}
+
+    if "lookup" in benchmarks:
+        results["benchmarks"]["lookup"] = [benchmark_subtitle_lookup(hours=0.5 if quick else 3, density=density) for density in TRANSCRIPT_DENSITIES]
+    if "offset" in benchmarks:
+        results["benchmarks"]["offset"] = benchmark_subtitle_offset(hours=0.5 if quick else 3)
+    if "render" in benchmarks:
+        results["benchmarks"]["render"] = benchmark_render(sizes, duration_s=2 if quick else 5, font_path=font_path)
+    if "clip" in benchmarks:
+        results["benchmarks"]["clip"] = benchmark_clip_modes(interval_counts=(5, 20) if quick else (5, 100), size=sizes[0])
+    if "news" in benchmarks:
+        results["benchmarks"]["news"] = benchmark_news_short(story_count=2 if quick else 3, font_path=font_path)
+
+    if output_file is None:
+        os.makedirs(BENCHMARK_RESULTS_FOLDER, exist_ok=True)
+        output_file = os.path.join(BENCHMARK_RESULTS_FOLDER, started.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(output_file, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=1)
+    print(f"Benchmark results saved to: {output_file}")
+    return output_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the render, cut and subtitle paths")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument("--quick", action="store_true", help="small inputs, to check the suite runs")
+    parser.add_argument("--font", default=FONT_PATH)
+    parser.add_argument("--output", help="results file, a new one in " + BENCHMARK_RESULTS_FOLDER + " by default")
+    args = parser.parse_args()
+
+    run_benchmarks(args.only, args.quick, args.font, args.output)
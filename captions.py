@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+OUTER_STROKE_WIDTH = 4
+INNER_STROKE_WIDTH = 1
+LINE_SPACING = 15
+CAPTION_OFFSET = 15
+
+
+@dataclass
+class CaptionSprite:
+    """
+    A caption rasterized once. Colours are premultiplied by alpha, so blending is
+    frame * (255 - alpha) / 255 + colour.
+    """
+    colour: np.ndarray      # (h, w, 1) uint8, the same value goes to every channel
+    alpha: np.ndarray       # (h, w, 1) uint8
+    offset: tuple[int, int] # where the sprite sits relative to the draw.text anchor
+    text_width: int         # textbbox size without stroke, used for layout like the PIL path
+    text_height: int
+
+
+class CaptionRenderer:
+    """
+    Rasterizes every distinct (text, font, size, stroke) combination once into a sprite,
+    keeps them in a bounded LRU and alpha blends them onto BGR/RGB frames.
+    """
+    def __init__(self, font_path: str, font_size: int, max_sprites: int = 256):
+        self.font_path = font_path
+        self.font_size = font_size
+        self.font = ImageFont.truetype(font_path, font_size)
+        self.max_sprites = max_sprites
+        self._sprites: OrderedDict[tuple, CaptionSprite] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _rasterize(self, text: str) -> CaptionSprite:
+        measure = ImageDraw.Draw(Image.new("L", (1, 1)))
+        bbox = measure.textbbox((0, 0), text, font=self.font)
+        left, top, right, bottom = measure.textbbox((0, 0), text, font=self.font, stroke_width=OUTER_STROKE_WIDTH)
+        size = (max(1, right - left), max(1, bottom - top))
+
+        # Coverage masks for the black outer stroke and the white inner text
+        outer = Image.new("L", size, 0)
+        ImageDraw.Draw(outer).text((-left, -top), text, font=self.font, fill=255, stroke_width=OUTER_STROKE_WIDTH)
+        inner = Image.new("L", size, 0)
+        ImageDraw.Draw(inner).text((-left, -top), text, font=self.font, fill=255, stroke_width=INNER_STROKE_WIDTH)
+
+        outer = np.asarray(outer, dtype=np.float32) / 255
+        inner = np.asarray(inner, dtype=np.float32) / 255
+
+        # black over the frame, then white over that: frame * (1-outer) * (1-inner) + 255 * inner
+        keep = (1 - outer) * (1 - inner)
+        alpha = np.rint(255 * (1 - keep)).astype(np.uint8)[..., None]
+        colour = np.rint(255 * inner).astype(np.uint8)[..., None]
+
+        return CaptionSprite(colour, alpha, (left, top), bbox[2] - bbox[0], bbox[3] - bbox[1])
+
+    def get_sprite(self, text: str) -> CaptionSprite:
+        key = (text, self.font_path, self.font_size, OUTER_STROKE_WIDTH, INNER_STROKE_WIDTH)
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self.hits += 1
+            self._sprites.move_to_end(key)
+            return sprite
+
+        self.misses += 1
+        sprite = self._rasterize(text)
+        self._sprites[key] = sprite
+        if len(self._sprites) > self.max_sprites:
+            self._sprites.popitem(last=False)
+        return sprite
+
+    def prewarm(self, texts: Iterable[str]) -> None:
+        """Rasterize captions ahead of time, e.g. in the parent before forking the worker pool."""
+        for text in texts:
+            if len(self._sprites) >= self.max_sprites:
+                break
+            self.get_sprite(text)
+
+    @staticmethod
+    def blend(frame: np.ndarray, sprite: CaptionSprite, x: int, y: int) -> None:
+        """Alpha blend the sprite onto frame in place, with its draw.text anchor at (x, y)."""
+        x += sprite.offset[0]
+        y += sprite.offset[1]
+        h, w = sprite.alpha.shape[:2]
+
+        # Clip against the frame the same way PIL drops out of bounds glyphs
+        left, top = max(x, 0), max(y, 0)
+        right, bottom = min(x + w, frame.shape[1]), min(y + h, frame.shape[0])
+        if left >= right or top >= bottom:
+            return
+
+        region = frame[top:bottom, left:right]
+        alpha = sprite.alpha[top - y:bottom - y, left - x:right - x].astype(np.uint16)
+        colour = sprite.colour[top - y:bottom - y, left - x:right - x]
+
+        blended = (region * (255 - alpha) + 127) // 255 + colour
+        region[:] = blended
+
+    def draw(self, frame: np.ndarray, texts: list[str], caption_top: int) -> None:
+        """Same layout as VideoEditor._draw_texts: centred lines stacked below caption_top."""
+        current_y = caption_top + CAPTION_OFFSET
+        frame_width = frame.shape[1]
+
+        for text in texts:
+            sprite = self.get_sprite(text)
+            x = (frame_width - sprite.text_width) // 2
+            self.blend(frame, sprite, x, current_y)
+            current_y += sprite.text_height + LINE_SPACING
+
+
+# One renderer per worker process. Sprites made before the pool forks are inherited by every worker.
+_renderers: dict[tuple, CaptionRenderer] = {}
+
+def get_caption_renderer(font_path: str, font_size: int) -> CaptionRenderer:
+    key = (font_path, font_size)
+    if key not in _renderers:
+        _renderers[key] = CaptionRenderer(font_path, font_size)
+    return _renderers[key]
@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import os
+import sqlite3
+import time
+from typing import Iterable, Optional
+from pipeline import Pipeline, Stage
+from yt_utils import VideoTools
+
+CATALOG_DB_PATH = "processed_data/catalog.sqlite3"
+# Every get_video_info is a page fetch, a handful at once is quick without getting rate limited
+INFO_CONCURRENCY = 8
+ORDERS = ["upload_date", "view_count", "duration"]
+
+
+class VideoCatalog:
+    """
+    Metadata of every video seen on an ingested playlist or channel, in SQLite, so episodes can be
+    picked by duration, upload date or views without asking YouTube again. Videos are keyed by id,
+    an ingest only fetches the ones the catalog doesn't have yet.
+    """
+    def __init__(self, db_path: str = CATALOG_DB_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.connection = sqlite3.connect(db_path, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS videos (
+                id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                title TEXT,
+                description TEXT,
+                duration INTEGER,
+                view_count INTEGER,
+                like_count INTEGER,
+                upload_date TEXT,
+                channel TEXT,
+                channel_url TEXT,
+                source_url TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        for column in ["duration", "upload_date", "view_count"]:
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS videos_{column} ON videos ({column})")
+        self.connection.commit()
+
+    def known_ids(self, ids: Iterable[str]) -> set[str]:
+        known = set()
+        ids = list(ids)
+        # SQLite caps the parameters of one statement
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            rows = self.connection.execute(f"SELECT id FROM videos WHERE id IN ({','.join('?' * len(batch))})", batch)
+            known.update(row["id"] for row in rows)
+        return known
+
+    def add(self, video_id: str, url: str, details: dict, source_url: str) -> None:
+        with self.connection:
+            self.connection.execute("""
+                INSERT OR REPLACE INTO videos (id, url, title, description, duration, view_count, like_count,
+                                               upload_date, channel, channel_url, source_url, fetched_at)
+                VALUES (:id, :url, :title, :description, :duration, :view_count, :like_count,
+                        :upload_date, :channel, :channel_url, :source_url, :fetched_at)
+            """, {**details, "id": video_id, "url": url, "source_url": source_url, "fetched_at": time.time()})
+
+    def query(self, min_duration: Optional[int] = None, max_duration: Optional[int] = None, since: Optional[str] = None,
+              until: Optional[str] = None, min_views: Optional[int] = None, order_by: str = "upload_date",
+              limit: Optional[int] = None) -> list[sqlite3.Row]:
+        """Videos matching every given filter, newest, most viewed or longest first. Durations in seconds, dates as YYYYMMDD."""
+        if order_by not in ORDERS:
+            raise ValueError(f"Unknown order {order_by}, expected one of {ORDERS}")
+        conditions, params = [], []
+        for condition, value in [("duration >= ?", min_duration), ("duration <= ?", max_duration), ("upload_date >= ?", since),
+                                 ("upload_date <= ?", until), ("view_count >= ?", min_views)]:
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        limit_clause = "LIMIT ?" if limit is not None else ""
+        if limit is not None:
+            params.append(limit)
+        return self.connection.execute(f"SELECT * FROM videos {where} ORDER BY {order_by} DESC {limit_clause}", params).fetchall()
+
+
+async def ingest(source_url: str, db_path: str = CATALOG_DB_PATH, concurrency: int = INFO_CONCURRENCY) -> int:
+    """
+    Lists the playlist or channel and fetches the metadata of the videos not in the catalog yet, up to
+    concurrency at a time. Each video is stored as soon as it arrives, so an interrupted ingest loses nothing.
+    Videos whose metadata couldn't be fetched are left out and tried again by the next ingest.
+    Returns how many were added.
+    """
+    catalog = VideoCatalog(db_path)
+    entries = await VideoTools.get_playlist_entries(source_url)
+    if entries is None:
+        return 0
+    known = catalog.known_ids(entry["id"] for entry in entries)
+    new_entries = [entry for entry in entries if entry["id"] not in known]
+    print(f"{len(entries)} videos in {source_url}, {len(new_entries)} not in the catalog")
+
+    async def fetch(entry):
+        details = await VideoTools.get_video_info(entry["url"])
+        if details is None:
+            raise RuntimeError("no metadata")
+        return entry, details
+
+    async def store(item):
+        entry, details = item
+        catalog.add(entry["id"], entry["url"], details, source_url)
+
+    pipeline = Pipeline([Stage("info", fetch, concurrency), Stage("store", store)])
+    return (await pipeline.run(new_entries))[-1].items
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local catalog of channel and playlist videos")
+    parser.add_argument("--db", default=CATALOG_DB_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("ingest", help="add the new videos of playlists or channels")
+    add.add_argument("urls", nargs="+")
+    add.add_argument("--concurrency", type=int, default=INFO_CONCURRENCY)
+    find = commands.add_parser("list", help="pick videos from the catalog")
+    find.add_argument("--min-minutes", type=float)
+    find.add_argument("--max-minutes", type=float)
+    find.add_argument("--since", help="upload date, YYYYMMDD")
+    find.add_argument("--until", help="upload date, YYYYMMDD")
+    find.add_argument("--min-views", type=int)
+    find.add_argument("--order", choices=ORDERS, default="upload_date")
+    find.add_argument("--limit", type=int)
+    find.add_argument("--urls-only", action="store_true", help="only the urls, e.g. for job_queue.py add")
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        for url in args.urls:
+            print(f"Added {asyncio.run(ingest(url, args.db, args.concurrency))} videos from {url}")
+    elif args.command == "list":
+        videos = VideoCatalog(args.db).query(
+            min_duration=args.min_minutes * 60 if args.min_minutes is not None else None,
+            max_duration=args.max_minutes * 60 if args.max_minutes is not None else None,
+            since=args.since, until=args.until, min_views=args.min_views, order_by=args.order, limit=args.limit)
+        for video in videos:
+            if args.urls_only:
+                print(video["url"])
+            else:
+                print(f"{video['upload_date'] or '-':8s} {(video['duration'] or 0) / 60:6.1f} min {video['view_count'] or 0:>12,d} views  {video['url']}  {video['title']}")
@@ -1,8 +1,15 @@
+import bisect
 import ffmpeg
 import os
-from typing import List, Tuple
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 import logging
+import tracing
+from artifact_cache import artifact_cache
 from csv_utils import CSVUtils
+from utils import get_frame_index
 
 def setup_logging():
     """Configure logging for the script"""
@@ -14,28 +21,209 @@ def setup_logging():
 
 logger = setup_logging()
 
+CUT_MODES = ["copy", "smart"]
 
-def split_media(input_file: str, output_prefix: str, intervals: List[Tuple[int, int]]) -> List[str]:
-    output_files = []
-    
-    for idx, (start_ms, end_ms) in enumerate(intervals):
-        start_sec = start_ms / 1000
-        duration_sec = (end_ms - start_ms) / 1000
-        
-        output_file = f"{output_prefix}_segment_{idx}.mp4"
-        output_files.append(output_file)
-        
-        try:
+# Encoders that produce the source codec again, so re-encoded and copied parts can be concatenated
+SMART_CUT_ENCODERS = {"h264": "libx264", "hevc": "libx265"}
+# Every part keeps its own parameter sets in-band, the concat demuxer only carries the first part's extradata
+SMART_CUT_BSFS = {"h264": "h264_mp4toannexb", "hevc": "hevc_mp4toannexb"}
+SMART_CUT_PROFILES = {
+    "h264": {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main", "High": "high", "High 10": "high10", "High 4:2:2": "high422"},
+    "hevc": {"Main": "main", "Main 10": "main10"},
+}
+SMART_CUT_CRF = 18
+
+# clip_video can also cut everything in one ffmpeg process, see trim_concat_media
+CLIP_MODES = CUT_MODES + ["filter"]
+# Above this many intervals a frame accurate clip is cut in one trim/concat process instead of
+# a smart cut (several processes, probes and seeks) per segment. "copy" is never switched,
+# it keeps the source's keyframe aligned cuts and skips the re-encode.
+FILTER_CUT_MIN_INTERVALS = 20
+# passthrough keeps the source timestamps, the concat filter loses the frame rate and ffmpeg would resample to 25 fps
+FILTER_CUT_ENCODER_ARGS = {'vcodec': 'libx264', 'pix_fmt': 'yuv420p', 'crf': SMART_CUT_CRF, 'preset': 'veryfast', 'fps_mode': 'passthrough', 'acodec': 'aac'}
+
+# Segments cut at once. Copying is I/O bound and smart cuts run a threaded encoder, so a few are enough.
+MAX_CUT_WORKERS = 4
+
+
+def _cut_segment(input_file: str, output_file: str, idx: int, start_ms: int, end_ms: int, mode: str) -> str:
+    start_sec = start_ms / 1000
+    duration_sec = (end_ms - start_ms) / 1000
+
+    try:
+        if mode == "smart":
+            smart_cut_segment(input_file, output_file, start_ms, end_ms)
+        else:
             stream = ffmpeg.input(input_file, ss=start_sec, t=duration_sec)
             stream = ffmpeg.output(stream, output_file, acodec='copy', vcodec='copy')
-            ffmpeg.run(stream, capture_stdout=True, capture_stderr=True)
-            logger.info(f"Successfully created segment {idx + 1}: {output_file}")
-            
-        except ffmpeg.Error as e:
-            logger.error(f"Error processing segment {idx + 1}: {str(e)}")
-            raise
-    
-    return output_files
+            ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
+        logger.info(f"Successfully created segment {idx + 1}: {output_file}")
+        return output_file
+
+    except ffmpeg.Error as e:
+        logger.error(f"Error processing segment {idx + 1}: {str(e)}")
+        raise
+
+def split_media(input_file: str, output_prefix: str, intervals: List[Tuple[int, int]], mode: str = "copy", max_workers: Optional[int] = None) -> List[str]:
+    """
+    Cuts every (start_ms, end_ms) interval into {output_prefix}_segment_{idx}.mp4, up to max_workers
+    (MAX_CUT_WORKERS by default) at a time. Returns the files in interval order.
+    mode:
+        "copy"  - stream copy, fast but segments can only start on a keyframe
+        "smart" - frame accurate, see smart_cut_segment
+    """
+    if mode not in CUT_MODES:
+        raise ValueError(f"Unknown cut mode {mode}, expected one of {CUT_MODES}")
+
+    if mode == "smart":
+        # Probe the keyframe index once up front instead of in every worker
+        get_frame_index(input_file)
+
+    with ThreadPoolExecutor(max_workers=max_workers or MAX_CUT_WORKERS) as pool:
+        futures = [
+            pool.submit(_cut_segment, input_file, f"{output_prefix}_segment_{idx}.mp4", idx, start_ms, end_ms, mode)
+            for idx, (start_ms, end_ms) in enumerate(intervals)
+        ]
+        # result() re-raises the first failure, the pool still waits for the running cuts
+        return [future.result() for future in futures]
+
+def _smart_cut_encoder_args(input_file: str) -> dict:
+    """Encoder settings that match the source's codec, profile and pixel format, or {} when it can't be matched."""
+    stream = ffmpeg.probe(input_file, select_streams='v:0')['streams'][0]
+    codec = stream.get('codec_name')
+    if codec not in SMART_CUT_ENCODERS:
+        return {}
+
+    args = {'vcodec': SMART_CUT_ENCODERS[codec], 'pix_fmt': stream.get('pix_fmt', 'yuv420p'), 'crf': SMART_CUT_CRF, 'preset': 'veryfast',
+            'bsf:v': SMART_CUT_BSFS[codec]}
+    profile = SMART_CUT_PROFILES[codec].get(stream.get('profile'))
+    if profile:
+        args['profile:v'] = profile
+    return args
+
+def _encode_frames(input_file: str, output_file: str, seek_sec: float, frame_count: int, encoder_args: dict):
+    # Input seeking decodes from the previous keyframe and drops frames before seek_sec, so this is frame accurate.
+    # Passthrough keeps the encoder from duplicating the first frame to fill the gap up to it.
+    stream = ffmpeg.input(input_file, ss=seek_sec)
+    stream = ffmpeg.output(stream.video, output_file, vframes=frame_count, fps_mode='passthrough', **encoder_args)
+    ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
+
+def _copy_frames(input_file: str, output_file: str, seek_sec: float, frame_count: int, bsf: str):
+    # Copying starts at the keyframe at or before seek_sec. With closed GOPs the first frame_count
+    # packets from a keyframe are exactly the next frame_count frames in display order.
+    # The keyframe lies before seek_sec, make_zero keeps the muxer from hiding it behind an edit list.
+    stream = ffmpeg.input(input_file, ss=seek_sec)
+    stream = ffmpeg.output(stream.video, output_file, vframes=frame_count, vcodec='copy', avoid_negative_ts='make_zero', **{'bsf:v': bsf})
+    ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
+
+def smart_cut_segment(input_file: str, output_file: str, start_ms: int, end_ms: int) -> str:
+    """
+    Frame accurate cut of [start_ms, end_ms) at close to stream copy speed. Only the partial GOPs at the head
+    and tail are re-encoded, with the source's codec parameters; the keyframe aligned middle is stream copied
+    and the parts are concatenated. The audio is re-encoded for the exact same span. Sources whose codec has
+    no matching encoder are re-encoded completely.
+    """
+    frame_times, keyframes = get_frame_index(input_file)
+    frame_duration = (frame_times[-1] - frame_times[0]) / max(1, len(frame_times) - 1)
+
+    # Frames [first, last) are shown inside the interval
+    first = bisect.bisect_left(frame_times, start_ms / 1000)
+    last = bisect.bisect_left(frame_times, end_ms / 1000)
+    if last <= first:
+        raise ValueError(f"No frames between {start_ms} and {end_ms} ms in {input_file}")
+
+    encoder_args = _smart_cut_encoder_args(input_file)
+    if not encoder_args:
+        logger.warning(f"No matching encoder for {input_file}, re-encoding the whole segment")
+        encoder_args = {'vcodec': 'libx264', 'pix_fmt': 'yuv420p', 'crf': SMART_CUT_CRF, 'preset': 'veryfast'}
+        copy_start = copy_end = None
+    else:
+        # First keyframe inside the interval and last keyframe at or before its end
+        next_keyframe = bisect.bisect_left(keyframes, first)
+        previous_keyframe = bisect.bisect_right(keyframes, last) - 1
+        copy_start = keyframes[next_keyframe] if next_keyframe < len(keyframes) else None
+        copy_end = keyframes[previous_keyframe] if previous_keyframe >= 0 else None
+
+    # (first frame, frame count, copy) for each part
+    if copy_start is None or copy_end is None or copy_start >= copy_end:
+        parts = [(first, last - first, False)]
+    else:
+        parts = [(first, copy_start - first, False), (copy_start, copy_end - copy_start, True), (copy_end, last - copy_end, False)]
+    parts = [part for part in parts if part[1] > 0]
+
+    part_files = []
+    try:
+        for idx, (part_start, frame_count, copy) in enumerate(parts):
+            part_file = f"{output_file}.part{idx}.mp4"
+            part_files.append(part_file)
+            if copy:
+                # A quarter frame late, so the seek can't land on the keyframe before
+                _copy_frames(input_file, part_file, frame_times[part_start] + frame_duration / 4, frame_count, encoder_args['bsf:v'])
+            else:
+                _encode_frames(input_file, part_file, max(0, frame_times[part_start] - frame_duration / 2), frame_count, encoder_args)
+
+        audio_file = f"{output_file}.audio.m4a"
+        part_files.append(audio_file)
+        end_sec = frame_times[last] if last < len(frame_times) else frame_times[-1] + frame_duration
+        audio = ffmpeg.input(input_file, ss=frame_times[first], t=end_sec - frame_times[first]).audio
+        ffmpeg.run(ffmpeg.output(audio, audio_file, acodec='aac'), overwrite_output=True, capture_stdout=True, capture_stderr=True)
+
+        concat_file = f"{output_file}.parts.txt"
+        part_files.append(concat_file)
+        create_concat_file(part_files[:len(parts)], concat_file)
+        video = ffmpeg.input(concat_file, f='concat', safe=0)
+        stream = ffmpeg.output(video.video, ffmpeg.input(audio_file).audio, output_file, c='copy')
+        ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
+
+        logger.info(f"Smart cut {output_file}: " + ", ".join(f"{'copy' if copy else 'encode'} {count}" for _, count, copy in parts))
+        return output_file
+
+    finally:
+        for part_file in part_files:
+            if os.path.exists(part_file):
+                os.remove(part_file)
+
+def trim_concat_media(input_file: str, output_file: str, intervals: List[Tuple[int, int]]) -> str:
+    """
+    Cuts and joins all (start_ms, end_ms) intervals in a single ffmpeg process: trim/atrim and setpts/asetpts
+    per interval, then one concat filter. The output is re-encoded and every interval keeps the same frames
+    [first, last) as smart_cut_segment, so both frame accurate modes cut identically.
+    Each interval reads its own seeked input of the same file, so only the kept parts of a long source
+    are decoded instead of everything between the first and the last interval.
+    """
+    has_audio = any(stream['codec_type'] == 'audio' for stream in ffmpeg.probe(input_file)['streams'])
+    frame_times, _ = get_frame_index(input_file)
+    frame_duration = (frame_times[-1] - frame_times[0]) / max(1, len(frame_times) - 1)
+
+    parts = []
+    for start_ms, end_ms in intervals:
+        first = bisect.bisect_left(frame_times, start_ms / 1000)
+        last = bisect.bisect_left(frame_times, end_ms / 1000)
+        if last <= first:
+            raise ValueError(f"No frames between {start_ms} and {end_ms} ms in {input_file}")
+        end_sec = frame_times[last] if last < len(frame_times) else frame_times[-1] + frame_duration
+
+        # Seeking half a frame early drops everything before frame first, so it is frame 0 of the trim.
+        # The input timestamps then start at the seek point, which puts the audio of frame first half a frame in.
+        seek_sec = max(0, frame_times[first] - frame_duration / 2)
+        source = ffmpeg.input(input_file, ss=seek_sec, t=end_sec - seek_sec + frame_duration)
+        parts.append(source.video.trim(start_frame=0, end_frame=last - first).setpts('PTS-STARTPTS'))
+        if has_audio:
+            audio_start = frame_times[first] - seek_sec
+            parts.append(source.audio.filter('atrim', start=audio_start, end=audio_start + end_sec - frame_times[first]).filter('asetpts', 'PTS-STARTPTS'))
+
+    joined = ffmpeg.concat(*parts, v=1, a=1 if has_audio else 0).node
+    streams = [joined[0], joined[1]] if has_audio else [joined[0]]
+    encoder_args = dict(FILTER_CUT_ENCODER_ARGS) if has_audio else {k: v for k, v in FILTER_CUT_ENCODER_ARGS.items() if k != 'acodec'}
+
+    try:
+        ffmpeg.run(ffmpeg.output(*streams, output_file, **encoder_args), overwrite_output=True, capture_stdout=True, capture_stderr=True)
+        logger.info(f"Cut {len(intervals)} intervals into {output_file} in one pass")
+        return output_file
+
+    except ffmpeg.Error as e:
+        logger.error(f"Error cutting {input_file}: {e.stderr.decode() if e.stderr else str(e)}")
+        raise
 
 def create_concat_file(file_list: List[str], concat_file: str):
     """
@@ -45,17 +233,18 @@ def create_concat_file(file_list: List[str], concat_file: str):
         for file_path in file_list:
             f.write(f"file '{os.path.abspath(file_path)}'\n")
 
-def merge_media_files(file_list: List[str], output_file: str):
+def merge_media_files(file_list: List[str], output_file: str, concat_file: Optional[str] = None):
     """
-    Merge multiple media files into a single file using the concat demuxer
+    Merge multiple media files into a single file using the concat demuxer.
+    The concat list defaults to a file next to output_file, so parallel jobs never share one.
     """
-    concat_file = "concat_list.txt"
+    concat_file = concat_file or f"{output_file}.concat.txt"
     create_concat_file(file_list, concat_file)
     
     try:
         stream = ffmpeg.input(concat_file, f='concat', safe=0)
         stream = ffmpeg.output(stream, output_file, c='copy')
-        ffmpeg.run(stream, capture_stdout=True, capture_stderr=True)
+        ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
         logger.info(f"Successfully merged files into: {output_file}")
 
         return output_file
@@ -68,34 +257,59 @@ def merge_media_files(file_list: List[str], output_file: str):
         if os.path.exists(concat_file):
             os.remove(concat_file)
 
+def clip_mode(mode: str, interval_count: int, auto_filter: bool = True) -> str:
+    """The mode clip_video actually cuts with: "smart" becomes "filter" above FILTER_CUT_MIN_INTERVALS unless auto_filter is off."""
+    if auto_filter and mode == "smart" and interval_count > FILTER_CUT_MIN_INTERVALS:
+        return "filter"
+    return mode
+
 def clip_video(video_file: str, intervals: List[Tuple[int, int]], 
-                       output_video: str):
+                       output_video: str, mode: str = "copy", max_workers: Optional[int] = None, auto_filter: bool = True):
     """
-    Main function to process video and audio files
+    Main function to process video and audio files.
+    mode is "filter" for trim_concat_media, or a split_media mode (which max_workers is passed to).
+    "smart" switches to "filter" above FILTER_CUT_MIN_INTERVALS intervals unless auto_filter is False,
+    both cut the same frames. The default "copy" is never switched, see clip_mode.
+    Every temporary file lives in a job directory of its own under the video's folder, which is
+    always removed, so several clips can be cut from the same folder at once.
     """
-    if(os.path.exists(output_video)):
+    mode = clip_mode(mode, len(intervals), auto_filter)
+    if mode not in CLIP_MODES:
+        raise ValueError(f"Unknown clip mode {mode}, expected one of {CLIP_MODES}")
+
+    cache_key = artifact_cache.key("clip", {"intervals": intervals, "mode": mode}, [video_file])
+    if artifact_cache.fetch(cache_key, output_video):
         return output_video
-    
-    try:
-        # Split video
-        logger.info("Processing video segments...")
-        video_segments = split_media(video_file, "temp_video", intervals)
-        print("Split videos - \n", video_segments)
-        
-        # Merge video segments
-        logger.info("Merging video segments...")
-        merge_media_files(video_segments, output_video)
-
-        # Clean up temporary files
-        for file in video_segments:
-            os.remove(file)
-            logger.info(f"Cleaned up temporary file: {file}")
+
+    with tracing.span("clip_video", mode=mode, intervals=len(intervals)):
+        job_dir = tempfile.mkdtemp(prefix="clip_", dir=os.path.dirname(os.path.abspath(video_file)))
+        try:
+            if mode == "filter":
+                clipped_video = os.path.join(job_dir, "clipped" + os.path.splitext(output_video)[1])
+                trim_concat_media(video_file, clipped_video, intervals)
+                os.replace(clipped_video, output_video)
+                return artifact_cache.store(cache_key, output_video)
+
+            # Split video
+            logger.info("Processing video segments...")
+            video_segments = split_media(video_file, os.path.join(job_dir, "temp_video"), intervals, mode, max_workers)
+            print("Split videos - \n", video_segments)
         
-        return output_video
+            # Merge video segments, then move the result into place so output_video is never half written
+            logger.info("Merging video segments...")
+            merged_video = os.path.join(job_dir, "merged" + os.path.splitext(output_video)[1])
+            merge_media_files(video_segments, merged_video)
+            os.replace(merged_video, output_video)
+
+            return artifact_cache.store(cache_key, output_video)
             
-    except Exception as e:
-        logger.error(f"An error occurred: {str(e)}")
-        raise
+        except Exception as e:
+            logger.error(f"An error occurred: {str(e)}")
+            raise
+
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            logger.info(f"Cleaned up job directory: {job_dir}")
 
 def get_intervals(file_name:str):
     timestamps = []
@@ -0,0 +1,222 @@
+from dataclasses import dataclass
+from typing import Optional
+import cv2
+import numpy as np
+
+OUTPUT_WIDTH = 1080
+OUTPUT_HEIGHT = 1920
+
+BLUR_PASSES = 3
+
+# Size of the thumbnail used to decide whether the previous background can be reused
+REUSE_THUMBNAIL_SIZE = (64, 36)
+
+
+def box_size_for_sigma(sigma: float) -> int:
+    # PIL's GaussianBlur is an extended box blur, three box passes approximate the same
+    # gaussian in O(1) per pixel instead of a 6*sigma wide kernel
+    return max(1, int((12 * sigma**2 / BLUR_PASSES + 1) ** 0.5) | 1)
+
+
+def working_resolution(original_width: int, original_height: int, zoom_factor: float) -> tuple[int, int]:
+    """
+    Smallest source size the portrait layout needs: the zoomed foreground is OUTPUT_WIDTH * zoom_factor
+    wide, so anything wider is only scaled down again. Sources that are already small enough are kept.
+    """
+    width = int(OUTPUT_WIDTH * zoom_factor)
+    if original_width <= width:
+        return original_width, original_height
+    return width, round(original_height * width / original_width)
+
+
+@dataclass(frozen=True)
+class BackgroundStage:
+    """
+    Settings for generating the blurred portrait background at low resolution.
+    scale:             the frame is shrunk by this factor before blurring, only the final 1080x1920 crop is upsampled
+    reuse_threshold:   mean absolute difference (0-255) between source thumbnails below which the
+                       previous background is reused. None always regenerates.
+    refresh_interval:  regenerate at least every this many frames, even on a static camera
+    """
+    scale: float = 0.125
+    reuse_threshold: Optional[float] = 2.0
+    refresh_interval: int = 30
+
+
+@dataclass
+class PortraitGeometry:
+    """Sizes and offsets of the portrait layout for one source resolution, shared by every backend."""
+    exploded_size: tuple[int, int]  # background blown up to this size, then cropped at crop_x
+    crop_x: int
+    fg_size: tuple[int, int]        # zoomed frame, cropped at fg_crop_x and pasted at paste_y
+    fg_crop_x: int
+    fg_height: int
+    paste_y: int
+
+    @classmethod
+    def for_source(cls, original_width: int, original_height: int, explosion_factor: int, zoom_factor: float) -> "PortraitGeometry":
+        # Same numbers as the PIL chain, so all backends line up pixel for pixel
+        exploded_size = (int(explosion_factor*OUTPUT_HEIGHT*OUTPUT_HEIGHT/OUTPUT_WIDTH), OUTPUT_HEIGHT * explosion_factor)
+
+        scale_factor = OUTPUT_WIDTH / original_width
+        fg_size = (int(OUTPUT_WIDTH * zoom_factor), int(original_height * scale_factor * zoom_factor))
+
+        return cls(
+            exploded_size=exploded_size,
+            crop_x=exploded_size[0]//2 - OUTPUT_WIDTH//2,
+            fg_size=fg_size,
+            fg_crop_x=(fg_size[0] - OUTPUT_WIDTH)//2 if zoom_factor != 1 else 0,
+            fg_height=fg_size[1],
+            paste_y=(OUTPUT_HEIGHT - fg_size[1]) // 2,
+        )
+
+    @property
+    def caption_top(self) -> int:
+        return OUTPUT_HEIGHT//2 + self.fg_height//2
+
+
+class Cv2Compositor:
+    """
+    NumPy/OpenCV version of the portrait layout built by VideoEditor.render_frame.
+    Works directly on the BGR ndarray from cap.read() and writes into a preallocated
+    1080x1920 BGR buffer, so the same buffer is reused for every frame in a worker.
+    """
+    def __init__(self, blur_radius: int, brightness_factor: float, explosion_factor: int, zoom_factor: float, background_stage: Optional[BackgroundStage] = None):
+        self.blur_radius = blur_radius
+        self.brightness_factor = brightness_factor
+        self.explosion_factor = explosion_factor
+        self.zoom_factor = zoom_factor
+        self.background_stage = background_stage
+
+        self.box_size = box_size_for_sigma(blur_radius)
+
+        self.output = np.empty((OUTPUT_HEIGHT, OUTPUT_WIDTH, 3), dtype=np.uint8)
+        self._source_size = None
+
+        if background_stage is not None:
+            self.low_res_box_size = box_size_for_sigma(blur_radius * background_stage.scale)
+            self._background = np.empty_like(self.output)
+            self._background_thumbnail = None
+            self._last_frame_number = None
+            self._frames_since_refresh = 0
+            self.background_renders = 0
+            self.background_reuses = 0
+
+    def _setup_geometry(self, original_width: int, original_height: int) -> None:
+        geometry = PortraitGeometry.for_source(original_width, original_height, self.explosion_factor, self.zoom_factor)
+        self.exploded_size = geometry.exploded_size
+        self.crop_x = geometry.crop_x
+        self.fg_size = geometry.fg_size
+        self.fg_crop_x = geometry.fg_crop_x
+        self.fg_height = geometry.fg_height
+        self.paste_y = geometry.paste_y
+        # Lanczos doesn't widen its kernel when shrinking, so fine detail aliases where PIL's filter
+        # would smooth it. Area averaging is cv2's antialiased downscale.
+        self.fg_interpolation = cv2.INTER_AREA if self.fg_size[0] < original_width else cv2.INTER_LANCZOS4
+
+        if self.background_stage is not None:
+            scale = self.background_stage.scale
+            self.low_res_size = (max(1, round(original_width * scale)), max(1, round(original_height * scale)))
+
+            # Maps the low resolution frame straight onto the 1080x1920 crop of the exploded
+            # background, so the upsample never produces pixels that get cropped away
+            kx = self.exploded_size[0] / self.low_res_size[0]
+            ky = self.exploded_size[1] / self.low_res_size[1]
+            self.background_transform = np.float32([
+                [kx, 0, 0.5*kx - 0.5 - self.crop_x],
+                [0, ky, 0.5*ky - 0.5],
+            ])
+            self._background_thumbnail = None
+
+        self._source_size = (original_width, original_height)
+
+    def composite_background(self, frame: np.ndarray, frame_number: Optional[int] = None) -> None:
+        """Blurred, exploded and darkened copy of the frame, written into self.output."""
+        if self.background_stage is not None:
+            self.composite_background_low_res(frame, frame_number)
+            return
+
+        background = frame
+        for _ in range(BLUR_PASSES):
+            background = cv2.blur(background, (self.box_size, self.box_size))
+        background = cv2.resize(background, self.exploded_size, interpolation=cv2.INTER_CUBIC)
+        background = background[:OUTPUT_HEIGHT, self.crop_x:self.crop_x + OUTPUT_WIDTH]
+        cv2.convertScaleAbs(background, dst=self.output, alpha=self.brightness_factor)
+
+    def _can_reuse_background(self, frame: np.ndarray, frame_number: Optional[int]) -> bool:
+        stage = self.background_stage
+        if stage.reuse_threshold is None:
+            return False
+
+        thumbnail = cv2.resize(frame, REUSE_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        previous = self._background_thumbnail
+        self._background_thumbnail = thumbnail
+
+        # A worker only sees some chunks of the timeline, the background of its last frame can be
+        # from before a cut another worker rendered. Reuse only follows on from the frame just before.
+        previous_number = self._last_frame_number
+        self._last_frame_number = frame_number
+        if frame_number is not None and (previous_number is None or frame_number != previous_number + 1):
+            return False
+
+        if previous is None or self._frames_since_refresh >= stage.refresh_interval:
+            return False
+
+        return cv2.absdiff(thumbnail, previous).mean() < stage.reuse_threshold
+
+    def composite_background_low_res(self, frame: np.ndarray, frame_number: Optional[int] = None) -> None:
+        """
+        Same background as composite_background, blurred on a heavily downscaled copy. Detail
+        is invisible after a radius 30 blur, so only the final crop is upsampled.
+        """
+        if self._can_reuse_background(frame, frame_number):
+            self._frames_since_refresh += 1
+            self.background_reuses += 1
+            np.copyto(self.output, self._background)
+            return
+
+        background = cv2.resize(frame, self.low_res_size, interpolation=cv2.INTER_AREA)
+        for _ in range(BLUR_PASSES):
+            background = cv2.blur(background, (self.low_res_box_size, self.low_res_box_size))
+
+        cv2.warpAffine(background, self.background_transform, (OUTPUT_WIDTH, OUTPUT_HEIGHT), dst=self._background,
+                       flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+        cv2.convertScaleAbs(self._background, dst=self._background, alpha=self.brightness_factor)
+        np.copyto(self.output, self._background)
+
+        self._frames_since_refresh = 0
+        self.background_renders += 1
+
+    def composite_foreground(self, frame: np.ndarray) -> None:
+        """Zoomed frame pasted over the vertical centre of self.output."""
+        foreground = cv2.resize(frame, self.fg_size, interpolation=self.fg_interpolation)
+        foreground = foreground[:, self.fg_crop_x:self.fg_crop_x + OUTPUT_WIDTH]
+
+        # Clip like PIL's paste does when the zoomed frame is taller than the canvas
+        top = max(self.paste_y, 0)
+        bottom = min(self.paste_y + self.fg_height, OUTPUT_HEIGHT)
+        self.output[top:bottom, :foreground.shape[1]] = foreground[top - self.paste_y:bottom - self.paste_y]
+
+    def composite(self, frame: np.ndarray, frame_number: Optional[int] = None) -> np.ndarray:
+        """
+        frame_number is the frame's place in the rendered timeline. Without it frames are
+        taken to arrive in order, as they do from a single decoder.
+        """
+        original_height, original_width = frame.shape[:2]
+        if self._source_size != (original_width, original_height):
+            self._setup_geometry(original_width, original_height)
+
+        self.composite_background(frame, frame_number)
+        self.composite_foreground(frame)
+
+        return self.output
+
+
+# One compositor (and so one set of output buffers) per worker process
+_compositors: dict[tuple, Cv2Compositor] = {}
+
+def get_compositor(blur_radius: int, brightness_factor: float, explosion_factor: int, zoom_factor: float, background_stage: Optional[BackgroundStage] = None) -> Cv2Compositor:
+    key = (blur_radius, brightness_factor, explosion_factor, zoom_factor, background_stage)
+    if key not in _compositors:
+        _compositors[key] = Cv2Compositor(*key)
+    return _compositors[key]
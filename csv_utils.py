@@ -1,4 +1,5 @@
 import csv
+import os
 from typing import Union
 
 
@@ -6,7 +7,9 @@ class CSVUtils:
 
     @classmethod
     def write_subtitles_to_csv(cls, output_file: str, contents: dict[str, Union[str, int]]):
-        with open(output_file, "w", newline="") as file:
+        # Written next to it and moved into place, so a cached copy hard linked to output_file is never rewritten
+        temp_file = output_file + ".tmp"
+        with open(temp_file, "w", newline="") as file:
             writer = csv.DictWriter(file, fieldnames=["text","startMs","endMs"])
             writer.writeheader()
 
@@ -18,7 +21,8 @@ class CSVUtils:
                 })
                 
             file.close()
-        
+
+        os.replace(temp_file, output_file)
         return output_file
     
     @classmethod
@@ -44,13 +48,30 @@ class CSVUtils:
         return contents
     
     @classmethod
-    def offset_csv_file_timestamps(cls, csv_file:str):
+    def offset_csv_file_timestamps(cls, csv_file:str, time_map=None):
+        """
+        Moves the cues onto the timeline of the clip cut from them. With a utils.TimeMap the cues are
+        mapped through it, so they line up with bridged intervals and cues outside the clip are dropped.
+        Without one, every gap between cues is assumed to have been cut.
+        """
         new_csv_file = csv_file.split(".csv")[0] + "_offsetted.csv"
 
         rows = cls.get_subtitles_as_dict(csv_file)
 
         rows.sort(key=lambda x: (x["startMs"], x["endMs"]))
 
+        if time_map is not None:
+            offset_rows = []
+            for row in rows:
+                span = time_map.map_span(row["startMs"], row["endMs"])
+                if span is None:
+                    continue
+                row["startMs"], row["endMs"] = int(span[0]), int(span[1])
+                offset_rows.append(row)
+
+            cls.write_subtitles_to_csv(new_csv_file, offset_rows)
+            return new_csv_file
+
         diff = rows[0]["startMs"]
 
         rows[0]["startMs"] -= diff
@@ -419,6 +419,48 @@ class ImageFilterExperimentation:
         processor = ImageFilterExperimentation()
         processor.create_grid()
 
+class RenderBackendParityCheck:
+    """
+    Renders the same clip with the Python compositor and with the ffmpeg filtergraph backend,
+    then saves side by side frames (Python left, ffmpeg right) and prints the PSNR of each pair.
+    """
+    def __init__(self, video_path, subtitles_path, font_path="fonts/komika-axis/KOMIKAX_.ttf", output_dir="data_dump/backend_parity", compositor="pil"):
+        from make_shorts import Subtitles, VideoEditor
+
+        self.output_dir = output_dir
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self.outputs = {}
+        for render_mode in ["pipe", "filtergraph"]:
+            output_path = os.path.join(self.output_dir, f"{render_mode}.mp4")
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            editor = VideoEditor(self.output_dir, video_path, output_path, Subtitles(subtitles_path), font_path=font_path,
+                                 render_mode=render_mode, compositor=compositor)
+            self.outputs[render_mode] = editor.process_video()
+
+    def compare(self, timestamps_ms=(500, 1500, 3000, 6000)):
+        results = []
+        for timestamp_ms in timestamps_ms:
+            frames = []
+            for render_mode in ["pipe", "filtergraph"]:
+                cap = cv2.VideoCapture(self.outputs[render_mode])
+                cap.set(cv2.CAP_PROP_POS_MSEC, timestamp_ms)
+                ret, frame = cap.read()
+                cap.release()
+                frames.append(frame if ret else None)
+
+            if frames[0] is None or frames[1] is None:
+                print(f"No frame at {timestamp_ms}ms")
+                continue
+
+            psnr = cv2.PSNR(frames[0], frames[1])
+            cv2.imwrite(os.path.join(self.output_dir, f"side_by_side_{timestamp_ms}.png"), cv2.hconcat(frames))
+            print(f"{timestamp_ms}ms - PSNR {psnr:.2f} dB")
+            results.append((timestamp_ms, psnr))
+
+        return results
+
 def temp():
     for dir in os.listdir("processed_data"):
         print("\"https://youtube.com/watch?v=", dir, "\",", sep="")
@@ -445,4 +487,5 @@ if __name__ == "__main__":
     # fp.create_enhancement_experiments()
     # fp.create_blur_brightness_grid()
     # print(check_free_cores())
+    # RenderBackendParityCheck("processed_data/<slug>/final_video.mp4", "processed_data/<slug>/subtitles_reduced_offsetted.csv").compare()
     temp()
@@ -0,0 +1,132 @@
+from fractions import Fraction
+from typing import Optional
+from PIL import ImageFont
+from compositor import OUTPUT_WIDTH, OUTPUT_HEIGHT, PortraitGeometry
+
+# Caption look of VideoEditor._draw_texts: white text with a 4px black outline, stacked 15px below the video
+ASS_OUTLINE_WIDTH = 4
+ASS_CAPTION_OFFSET = 15
+ASS_LINE_SPACING = 15
+
+
+def _escape_filter_path(path: str) -> str:
+    # ':' and '\' separate options inside a filter, quotes delimit the value
+    return path.replace("\\", "/").replace(":", "\\:").replace("'", "\\'")
+
+def _ass_timestamp(ms: float) -> str:
+    centiseconds = int(round(ms / 10))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    seconds, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
+
+def _ass_text(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("{", "\\{").replace("}", "\\}").replace("\n", "\\N")
+
+def write_ass_subtitles(output_file: str, entries, ranges_ms: list[tuple[float, float]], font: ImageFont.FreeTypeFont, caption_top: int) -> str:
+    """
+    Writes the cues as an ASS file that looks like the Python caption drawing. ranges_ms are the kept
+    (start, end) parts of the source timeline, cues are clipped to them and moved onto the output timeline.
+
+    libass fixes a line's position when its event starts, while the Python path restacks the active
+    cues on every frame. So one event is written per line for every stretch where the set of active
+    cues is constant, each placed with \\pos like _draw_texts would.
+    """
+    # libass sizes fonts by ascent + descent, PIL by the em square
+    ass_font_size = sum(font.getmetrics())
+
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {OUTPUT_WIDTH}",
+        f"PlayResY: {OUTPUT_HEIGHT}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding",
+        f"Style: Caption,{font.getname()[0]},{ass_font_size},&H00FFFFFF,&H00FFFFFF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,{ASS_OUTLINE_WIDTH},0,7,0,0,0,1",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+
+    # Cues on the output timeline, in file order
+    cues = []
+    output_offset = 0
+    for range_start, range_end in ranges_ms:
+        for idx, entry in enumerate(entries):
+            if entry.end_ms < range_start or entry.start_ms > range_end:
+                continue
+            start = max(entry.start_ms, range_start) - range_start + output_offset
+            end = min(entry.end_ms, range_end) - range_start + output_offset
+            cues.append((start, end, idx, entry.text))
+        output_offset += range_end - range_start
+    cues.sort(key=lambda cue: cue[2])
+
+    boundaries = sorted({time for start, end, _, _ in cues for time in (start, end)})
+    for segment_start, segment_end in zip(boundaries[:-1], boundaries[1:]):
+        current_y = caption_top + ASS_CAPTION_OFFSET
+        for start, end, _, text in cues:
+            if start > segment_start or end < segment_end:
+                continue
+            bbox = font.getbbox(text)
+            x = (OUTPUT_WIDTH - (bbox[2] - bbox[0])) // 2
+            lines.append(f"Dialogue: 0,{_ass_timestamp(segment_start)},{_ass_timestamp(segment_end)},Caption,,0,0,0,,{{\\pos({x},{current_y})}}{_ass_text(text)}")
+            current_y += bbox[3] - bbox[1] + ASS_LINE_SPACING
+
+    with open(output_file, "w", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+
+    return output_file
+
+def build_portrait_filtergraph(source_size: tuple[int, int], geometry: PortraitGeometry, blur_radius: int, brightness_factor: float,
+                               subtitles_file: str, fonts_dir: str, frame_ranges: Optional[list[tuple[int, int]]] = None,
+                               prescale: Optional[str] = None, fps: Optional[float] = None) -> str:
+    """
+    The portrait layout of VideoEditor.render_frame as one filtergraph reading [0:v:0] and writing [vout]:
+    split, gblur, crop/scale, darken, lanczos zoom, overlay and the ASS captions.
+    frame_ranges, when given, keeps only those source frames [start, end), fps is then the source frame rate.
+    prescale is a scale filter applied before the layout, source_size is then the size it scales to.
+    """
+    parts = []
+    source = "[0:v:0]"
+    if frame_ranges is not None:
+        for idx, (start_frame, end_frame) in enumerate(frame_ranges):
+            parts.append(f"[0:v:0]trim=start_frame={start_frame}:end_frame={end_frame},setpts=PTS-STARTPTS[v{idx}]")
+        labels = "".join(f"[v{idx}]" for idx in range(len(frame_ranges)))
+        # concat drops the frame rate, without it the encoder falls back to 25 fps and drops frames to get there
+        parts.append(f"{labels}concat=n={len(frame_ranges)}:v=1:a=0,fps={filter_frame_rate(fps)}[src]")
+        source = "[src]"
+
+    if prescale is not None:
+        parts.append(f"{source}{prescale}[scaled]")
+        source = "[scaled]"
+
+    # Crop the background in source pixels first, so the exploded canvas is never built
+    original_width, original_height = source_size
+    scale_x = original_width / geometry.exploded_size[0]
+    scale_y = original_height / geometry.exploded_size[1]
+    crop = f"{OUTPUT_WIDTH * scale_x:.3f}:{OUTPUT_HEIGHT * scale_y:.3f}:{geometry.crop_x * scale_x:.3f}:0"
+
+    fg_width, fg_height = geometry.fg_size
+    subtitles = f"subtitles=filename='{_escape_filter_path(subtitles_file)}':fontsdir='{_escape_filter_path(fonts_dir)}'"
+
+    # Blurring in planar RGB keeps the chroma close to the PIL blur, three steps approximate a true gaussian
+    parts += [
+        f"{source}split=2[bg][fg]",
+        f"[bg]format=gbrp,gblur=sigma={blur_radius}:steps=3,crop={crop},scale={OUTPUT_WIDTH}:{OUTPUT_HEIGHT}:flags=bicubic,setsar=1,"
+        f"colorchannelmixer=rr={brightness_factor}:gg={brightness_factor}:bb={brightness_factor}[bgd]",
+        f"[fg]scale={fg_width}:{fg_height}:flags=lanczos,crop={OUTPUT_WIDTH}:{fg_height}:{geometry.fg_crop_x}:0[fgz]",
+        f"[bgd][fgz]overlay=0:{geometry.paste_y},{subtitles},setsar=1,format=yuv420p[vout]",
+    ]
+    return ";".join(parts)
+
+def filter_frame_rate(fps: float) -> str:
+    # OpenCV reports NTSC rates as floats like 29.97002997, ffmpeg wants the exact 30000/1001
+    rate = Fraction(fps).limit_denominator(1001)
+    return f"{rate.numerator}/{rate.denominator}"
+
+def frame_ranges_to_ms(frame_ranges: list[tuple[int, float]], fps: float) -> list[tuple[float, float]]:
+    # An open ended range (math.inf) stays open ended
+    return [(start_frame / fps * 1000, end_frame / fps * 1000) for start_frame, end_frame in frame_ranges]
@@ -0,0 +1,110 @@
+import subprocess
+from typing import Optional
+import cv2
+import numpy as np
+
+# swscale filters accepted for the prescale, roughly from fastest to sharpest
+PRESCALE_FILTERS = ["fast_bilinear", "bilinear", "bicubic", "area", "lanczos"]
+
+
+def prescale_filter(size: tuple[int, int], flags: str) -> str:
+    return f"scale={size[0]}:{size[1]}:flags={flags}"
+
+
+class FfmpegFrameReader:
+    """
+    Reads BGR frames through an ffmpeg pipe, scaled inside ffmpeg to size before they ever
+    reach Python. Implements the part of cv2.VideoCapture the renderer uses (read, grab,
+    get, set(CAP_PROP_POS_FRAMES), release), so it can stand in for it.
+    """
+    def __init__(self, video_path: str, size: Optional[tuple[int, int]] = None, scale_flags: str = "lanczos"):
+        if scale_flags not in PRESCALE_FILTERS:
+            raise ValueError(f"Unknown scale flags {scale_flags}, expected one of {PRESCALE_FILTERS}")
+
+        # Container metadata only, nothing is decoded
+        probe = cv2.VideoCapture(video_path)
+        self.fps = probe.get(cv2.CAP_PROP_FPS)
+        self.source_size = (int(probe.get(cv2.CAP_PROP_FRAME_WIDTH)), int(probe.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.frame_count = int(probe.get(cv2.CAP_PROP_FRAME_COUNT))
+        probe.release()
+
+        self.video_path = video_path
+        self.size = size or self.source_size
+        self.scale_flags = scale_flags
+        self.frame_bytes = self.size[0] * self.size[1] * 3
+        self.position = 0
+        self._process = None
+        self._scratch = None
+
+    def _start(self) -> None:
+        cmd = ['ffmpeg', '-loglevel', 'error', '-nostdin']
+        if self.position > 0:
+            # Input seeking decodes from the previous keyframe and drops everything before the
+            # timestamp. Half a frame early so float rounding never drops the frame itself.
+            cmd += ['-ss', f"{(self.position - 0.5) / self.fps:.6f}"]
+        cmd += ['-i', self.video_path, '-map', '0:v:0']
+        if self.size != self.source_size:
+            cmd += ['-vf', prescale_filter(self.size, self.scale_flags)]
+        cmd += ['-fps_mode', 'passthrough', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+
+        self._process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+
+    def _read_into(self, buffer) -> bool:
+        if self._process is None:
+            self._start()
+
+        view = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < self.frame_bytes:
+            count = self._process.stdout.readinto(view[filled:])
+            if not count:
+                return False
+            filled += count
+        self.position += 1
+        return True
+
+    def read(self) -> tuple[bool, Optional[np.ndarray]]:
+        frame = np.empty((self.size[1], self.size[0], 3), dtype=np.uint8)
+        if not self._read_into(frame):
+            return False, None
+        return True, frame
+
+    def grab(self) -> bool:
+        # ffmpeg decodes every frame anyway, skipping one only saves the array allocation
+        if self._scratch is None:
+            self._scratch = bytearray(self.frame_bytes)
+        return self._read_into(self._scratch)
+
+    def get(self, prop: int) -> float:
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.size[0]
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.size[1]
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.frame_count
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.position
+        return 0
+
+    def set(self, prop: int, value: float) -> bool:
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        # Restart ffmpeg at the new position
+        self.release()
+        self.position = int(value)
+        return True
+
+    def isOpened(self) -> bool:
+        return self.frame_count > 0
+
+    def release(self) -> None:
+        if self._process is None:
+            return
+        # Nothing is written by the reader, so ffmpeg can just be killed. A terminated
+        # ffmpeg still flushes into the closed pipe and reports it as an error.
+        self._process.kill()
+        self._process.stdout.close()
+        self._process.wait()
+        self._process = None
@@ -0,0 +1,40 @@
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+import numpy as np
+
+
+class FrameRing:
+    """
+    A fixed number of equally sized uint8 frame slots in one shared memory block.
+    The parent creates the ring, workers attach to it by name, and only slot indices
+    travel between processes.
+    """
+    def __init__(self, slots: int, shape: tuple[int, ...], name: Optional[str] = None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.slot_bytes = int(np.prod(self.shape))
+        self._owner = name is None
+
+        if self._owner:
+            self.shm = SharedMemory(create=True, size=slots * self.slot_bytes)
+        else:
+            self.shm = SharedMemory(name=name)
+
+        self.array = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    def slot(self, idx: int) -> np.ndarray:
+        return self.array[idx]
+
+    def buffer(self, idx: int) -> memoryview:
+        """Raw bytes of a slot, e.g. to write straight into the encoder's stdin."""
+        return self.shm.buf[idx * self.slot_bytes:(idx + 1) * self.slot_bytes]
+
+    def attach_args(self) -> tuple:
+        return (self.slots, self.shape, self.shm.name)
+
+    def close(self) -> None:
+        # numpy views keep the buffer exported, they have to go before the block can be closed
+        del self.array
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
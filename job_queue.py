@@ -0,0 +1,294 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
+import tracing
+from llm import LLM
+from main import TRACE_REPORT_NAME, download_intervals, render_short, select_intervals
+from yt_utils import VideoTools
+
+JOB_DB_PATH = "processed_data/jobs.sqlite3"
+# A job's stage is the last one it completed. Only the selected parts are downloaded, so that comes after the LLM.
+STAGES = ["queued", "subtitled", "selected", "cut", "downloaded", "rendered"]
+MAX_ATTEMPTS = 5
+# Wait before retry n is RETRY_BACKOFF_SECONDS * 2**(n-1)
+RETRY_BACKOFF_SECONDS = 60
+POLL_SECONDS = 10
+# A worker renews the claims on its running jobs every POLL_SECONDS, however long a stage takes. A claim not
+# renewed for this long belongs to a worker that died or lost the database, and is handed out again.
+STALE_CLAIM_SECONDS = 5 * 60
+
+
+class JobQueue:
+    """
+    Durable queue of episodes in SQLite. Every job records the last stage it completed, the paths it
+    produced, its attempts and last error, so a worker can resume it after a crash or reboot.
+    Claims are taken inside an immediate transaction, so several workers can share one database.
+    A claim is held by host:pid and kept alive by heartbeat.
+    """
+    def __init__(self, db_path: str = JOB_DB_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.connection = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL UNIQUE,
+                video_dir TEXT NOT NULL,
+                stage TEXT NOT NULL DEFAULT 'queued',
+                status TEXT NOT NULL DEFAULT 'pending',
+                artifacts TEXT NOT NULL DEFAULT '{}',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                claimed_by TEXT,
+                claimed_at REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, next_attempt_at)")
+
+    @contextmanager
+    def _transaction(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def enqueue(self, urls: list[str], data_folder: str = "processed_data") -> int:
+        """Adds the urls that aren't queued yet. Returns how many were added."""
+        now = time.time()
+        with self._transaction() as connection:
+            added = 0
+            for url in urls:
+                video_dir = data_folder+"/"+VideoTools.get_slug_from_yt_video_url(url)
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO jobs (url, video_dir, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                    (url, video_dir, now, now))
+                added += cursor.rowcount
+        return added
+
+    def claim(self, worker_id: str) -> Optional[sqlite3.Row]:
+        """Takes the oldest job that is due, or one whose worker went silent. None if nothing is due."""
+        now = time.time()
+        with self._transaction() as connection:
+            job = connection.execute("""
+                SELECT * FROM jobs
+                WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'running' AND claimed_at < ?)
+                ORDER BY next_attempt_at, id LIMIT 1
+            """, (now, now - STALE_CLAIM_SECONDS)).fetchone()
+            if job is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'running', claimed_by = ?, claimed_at = ?, updated_at = ? WHERE id = ?",
+                (worker_id, now, now, job["id"]))
+        return self.get(job["id"])
+
+    def heartbeat(self, worker_id: str) -> None:
+        """Renews the claims of the worker's running jobs, so they aren't taken as stale."""
+        with self._transaction() as connection:
+            connection.execute("UPDATE jobs SET claimed_at = ? WHERE status = 'running' AND claimed_by = ?", (time.time(), worker_id))
+
+    def release_dead_claims(self, worker_id: str) -> int:
+        """
+        Puts the running jobs of workers on this host whose process is gone back in the queue, without
+        counting an attempt. Run by a worker before it claims anything, so its own id only has claims
+        left by an earlier process with the same pid. Returns how many were released.
+        """
+        host = worker_id.rsplit(":", 1)[0]
+        released = 0
+        with self._transaction() as connection:
+            jobs = connection.execute("SELECT id, claimed_by FROM jobs WHERE status = 'running' AND substr(claimed_by, 1, ?) = ?",
+                                      (len(host) + 1, host + ":")).fetchall()
+            for job in jobs:
+                pid = int(job["claimed_by"].rsplit(":", 1)[1])
+                if job["claimed_by"] != worker_id and _process_alive(pid):
+                    continue
+                connection.execute(
+                    "UPDATE jobs SET status = 'pending', claimed_by = NULL, claimed_at = NULL, updated_at = ? WHERE id = ?",
+                    (time.time(), job["id"]))
+                released += 1
+        return released
+
+    def get(self, job_id: int) -> sqlite3.Row:
+        return self.connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def advance(self, job_id: int, stage: str, **artifacts) -> None:
+        """Records a completed stage and what it produced. Also renews the claim."""
+        now = time.time()
+        with self._transaction() as connection:
+            job = connection.execute("SELECT artifacts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            merged = {**json.loads(job["artifacts"]), **artifacts}
+            status = "done" if stage == STAGES[-1] else "running"
+            connection.execute(
+                "UPDATE jobs SET stage = ?, status = ?, artifacts = ?, claimed_at = ?, updated_at = ? WHERE id = ?",
+                (stage, status, json.dumps(merged), now, now, job_id))
+
+    def fail(self, job_id: int, error: str) -> None:
+        """Schedules a retry with exponential backoff, or gives up after MAX_ATTEMPTS."""
+        now = time.time()
+        with self._transaction() as connection:
+            attempts = connection.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()["attempts"] + 1
+            status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+            next_attempt_at = now + RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+            connection.execute("""
+                UPDATE jobs SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?,
+                                claimed_by = NULL, claimed_at = NULL, updated_at = ?
+                WHERE id = ?
+            """, (status, attempts, error, next_attempt_at, now, job_id))
+
+    def retry_failed(self) -> int:
+        """Puts jobs that ran out of attempts back in the queue, keeping their completed stages."""
+        with self._transaction() as connection:
+            return connection.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, next_attempt_at = 0 WHERE status = 'failed'").rowcount
+
+    def next_due(self) -> Optional[float]:
+        row = self.connection.execute("SELECT MIN(next_attempt_at) FROM jobs WHERE status = 'pending'").fetchone()
+        return row[0]
+
+    def summary(self) -> list[sqlite3.Row]:
+        return self.connection.execute(
+            "SELECT status, stage, COUNT(*) AS jobs FROM jobs GROUP BY status, stage ORDER BY status, stage").fetchall()
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Another user's process
+        return True
+    return True
+
+async def run_job(queue: JobQueue, job: sqlite3.Row, render_pool: ProcessPoolExecutor) -> None:
+    """Runs the stages after the job's last completed one, recording each as it finishes."""
+    os.makedirs(job["video_dir"], exist_ok=True)
+    tracer = tracing.Tracer("job", url=job["url"], attempt=job["attempts"] + 1, resumed_after=job["stage"])
+    try:
+        with tracer:
+            await _run_stages(queue, job, render_pool)
+    finally:
+        tracer.write_report(os.path.join(job["video_dir"], TRACE_REPORT_NAME))
+
+async def _run_stages(queue: JobQueue, job: sqlite3.Row, render_pool: ProcessPoolExecutor) -> None:
+    artifacts = json.loads(job["artifacts"])
+    url, video_dir = job["url"], job["video_dir"]
+    completed = STAGES.index(job["stage"])
+    if job["stage"] == "downloaded" and "intervals" not in artifacts:
+        # Downloaded first, when the whole episode was, it has nothing else yet
+        completed = 0
+
+    if completed < STAGES.index("subtitled"):
+        with tracing.span("subtitles"):
+            subtitles_path = await VideoTools.download_yt_subtitles(url, video_dir)
+        if subtitles_path is None:
+            raise RuntimeError("subtitles download failed")
+        queue.advance(job["id"], "subtitled", subtitles_path=subtitles_path)
+        artifacts["subtitles_path"] = subtitles_path
+
+    if completed < STAGES.index("selected"):
+        with tracing.span("llm_selection"):
+            reduced_subtitles_path = await asyncio.to_thread(LLM.generate_script_gemini, video_dir, artifacts["subtitles_path"])
+        queue.advance(job["id"], "selected", reduced_subtitles_path=reduced_subtitles_path)
+        artifacts["reduced_subtitles_path"] = reduced_subtitles_path
+
+    if completed < STAGES.index("cut"):
+        # The editor cuts while it renders, this stage fixes the intervals it will keep
+        intervals = select_intervals(artifacts["reduced_subtitles_path"])
+        if not intervals:
+            raise RuntimeError("no intervals selected")
+        queue.advance(job["id"], "cut", intervals=intervals)
+        artifacts["intervals"] = intervals
+
+    if completed < STAGES.index("downloaded"):
+        intervals = [tuple(interval) for interval in artifacts["intervals"]]
+        with tracing.span("download"):
+            downloaded = await download_intervals(url, video_dir, intervals, artifacts["reduced_subtitles_path"])
+        if downloaded is None:
+            raise RuntimeError("video download failed")
+        video_path, video_intervals, video_subtitles_path = downloaded
+        queue.advance(job["id"], "downloaded", video_path=video_path, video_intervals=video_intervals, video_subtitles_path=video_subtitles_path)
+        artifacts.update(video_path=video_path, video_intervals=video_intervals, video_subtitles_path=video_subtitles_path)
+
+    if completed < STAGES.index("rendered"):
+        loop = asyncio.get_running_loop()
+        intervals = [tuple(interval) for interval in artifacts["video_intervals"]]
+        with tracing.span("render"):
+            final_video_path, render_trace = await loop.run_in_executor(
+                render_pool, render_short, video_dir, artifacts["video_path"], artifacts["video_subtitles_path"], intervals)
+            tracing.attach(render_trace)
+        queue.advance(job["id"], "rendered", final_video_path=final_video_path)
+
+async def worker(db_path: str = JOB_DB_PATH, concurrency: int = 1, exit_when_idle: bool = False) -> None:
+    """
+    Claims and runs jobs until stopped, up to concurrency at a time. With exit_when_idle it returns
+    once no job is running or due, instead of waiting for retries and new jobs.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    queue = JobQueue(db_path)
+    running = set()
+
+    released = queue.release_dead_claims(worker_id)
+    if released:
+        print(f"{worker_id}: released {released} jobs of stopped workers")
+
+    with ProcessPoolExecutor(concurrency) as render_pool:
+        async def run(job):
+            print(f"{worker_id}: {job['url']} from stage {job['stage']} (attempt {job['attempts'] + 1})")
+            try:
+                await run_job(queue, job, render_pool)
+                print(f"{worker_id}: {job['url']} rendered")
+            except Exception as e:
+                queue.fail(job["id"], f"{type(e).__name__}: {e}")
+                print(f"{worker_id}: error processing {job['url']}: ", e)
+
+        while True:
+            while len(running) < concurrency and (job := queue.claim(worker_id)) is not None:
+                running.add(asyncio.create_task(run(job)))
+
+            if not running:
+                next_due = queue.next_due()
+                if exit_when_idle and (next_due is None or next_due > time.time()):
+                    return
+                await asyncio.sleep(POLL_SECONDS if next_due is None else min(POLL_SECONDS, max(0, next_due - time.time())))
+                continue
+
+            _, running = await asyncio.wait(running, timeout=POLL_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+            queue.heartbeat(worker_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent episode queue")
+    parser.add_argument("--db", default=JOB_DB_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="queue youtube urls")
+    add.add_argument("urls", nargs="+")
+    run = commands.add_parser("worker", help="claim and process jobs")
+    run.add_argument("--concurrency", type=int, default=1)
+    run.add_argument("--exit-when-idle", action="store_true")
+    commands.add_parser("status", help="jobs per status and stage")
+    commands.add_parser("retry-failed", help="requeue jobs that ran out of attempts")
+    args = parser.parse_args()
+
+    if args.command == "add":
+        print(f"Queued {JobQueue(args.db).enqueue(args.urls)} new jobs")
+    elif args.command == "worker":
+        asyncio.run(worker(args.db, args.concurrency, args.exit_when_idle))
+    elif args.command == "status":
+        for row in JobQueue(args.db).summary():
+            print(f"{row['status']:8s} {row['stage']:10s} {row['jobs']}")
+    elif args.command == "retry-failed":
+        print(f"Requeued {JobQueue(args.db).retry_failed()} jobs")
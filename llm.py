@@ -5,11 +5,22 @@ import typing
 import google.generativeai as genai
 import sys
 
+import tracing
+from artifact_cache import artifact_cache
 from csv_utils import CSVUtils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
+GEMINI_MODEL = "gemini-2.0-flash-exp"
+GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 64,
+    "max_output_tokens": 8192,
+    "response_mime_type": "application/json",
+}
+
 @dataclass
 class Schema:
     csv_file_contents: str 
@@ -57,14 +68,17 @@ class LLM:
     @classmethod
     def generate_script_gemini(cls, output_dir: str, subtitles_csv_path: str, generated_file_name: str = "subtitles_reduced.csv"):
         generated_file_path = os.path.join(output_dir, generated_file_name)
-        if(os.path.exists(generated_file_path)):
+        # The selection depends on the transcript, the prompt and the model
+        cache_key = artifact_cache.key("llm_selection", {"prompt": cls.get_prompt(""), "model": GEMINI_MODEL, "config": GENERATION_CONFIG}, [subtitles_csv_path])
+        if artifact_cache.fetch(cache_key, generated_file_path):
             return generated_file_path
 
         csv_contents = CSVUtils.get_csv_contents_as_string(subtitles_csv_path)
 
         hydrated_prompt = cls.get_prompt(csv_contents)
 
-        response = cls.call_gemini(hydrated_prompt, Schema)
+        with tracing.span("gemini", model=GEMINI_MODEL, prompt_chars=len(hydrated_prompt)):
+            response = cls.call_gemini(hydrated_prompt, Schema)
 
         response_dict = json.loads(response)
 
@@ -74,22 +88,18 @@ class LLM:
 
         output_file = CSVUtils.write_subtitles_to_csv(output_file, csv_file_contents)
 
-        return output_file
+        return artifact_cache.store(cache_key, output_file)
 
     @classmethod
     def call_gemini(cls, prompt: str, schema: typing.Type[Schema] = Schema):
 
         generation_config = {
-            "temperature": 1,
-            "top_p": 0.95,
-            "top_k": 64,
-            "max_output_tokens": 8192,
-            "response_mime_type": "application/json",
+            **GENERATION_CONFIG,
             "response_schema": schema,
         }
 
         model = genai.GenerativeModel(
-            model_name="gemini-2.0-flash-exp",
+            model_name=GEMINI_MODEL,
             generation_config=generation_config,
         )
 
@@ -1,38 +1,164 @@
 import asyncio
-from csv_utils import CSVUtils
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Optional
+import tracing
 from make_shorts import Subtitles, VideoEditor
-from clip_new import get_intervals, clip_video
+from pipeline import Pipeline, Stage
+from static_frames import StaticFrameSkip
+from clip_new import get_intervals
+from csv_utils import CSVUtils
 from llm import LLM
-from utils import merge_intervals
-from yt_utils import VideoTools
+from utils import CAPTION_GAP_TOLERANCE_MS, MIN_SEGMENT_MS, merge_intervals
+from yt_utils import ProgressStream, VideoTools
+
+# Transcripts, downloads and the LLM call are mostly waiting, several of each can overlap.
+# A render already uses every core, a second one only helps while the first is encoding.
+TRANSCRIPT_CONCURRENCY = 4
+DOWNLOAD_CONCURRENCY = 2
+LLM_CONCURRENCY = 4
+RENDER_CONCURRENCY = 1
+TRACE_REPORT_NAME = "trace_report.json"
+
+
+@dataclass
+class Job:
+    url: str
+    video_dir: str
+    video_path: Optional[str] = None
+    subtitles_path: Optional[str] = None
+    reduced_subtitles_path: Optional[str] = None
+    # On the source timeline until the download moves them, with reduced_subtitles_path, onto video_path's
+    intervals: Optional[list[tuple[int, int]]] = None
+    final_video_path: Optional[str] = None
+    tracer: tracing.Tracer = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.tracer is None:
+            self.tracer = tracing.Tracer("job", url=self.url)
+
+    def __str__(self):
+        return self.url
+
+    def write_trace(self):
+        return self.tracer.write_report(os.path.join(self.video_dir, TRACE_REPORT_NAME))
+
+def select_intervals(reduced_subtitles_path: str) -> list[tuple[int, int]]:
+    return merge_intervals(get_intervals(reduced_subtitles_path), CAPTION_GAP_TOLERANCE_MS, MIN_SEGMENT_MS)
 
-async def perform_work(video_urls: list[str]):
+def render_short(video_dir: str, video_path: str, reduced_subtitles_path: str, intervals: Optional[list[tuple[int, int]]] = None) -> tuple[str, Optional[dict]]:
+    """
+    Cut and render one episode. Runs in the render process pool, so its trace comes back
+    with the output path (None when tracing is off) for tracing.attach.
+    """
+    with tracing.Tracer("render_short") as tracer:
+        if intervals is None:
+            intervals = select_intervals(reduced_subtitles_path)
+        final_video_path = video_dir+"/final_video_subbed.mp4"
+
+        # Single pass: the editor decodes only the intervals of the source video, so there is no
+        # intermediate final_video.mp4 and the subtitles stay on the source timeline
+        editor = VideoEditor(video_dir, video_path, output_path=final_video_path, subtitles=Subtitles(reduced_subtitles_path), render_mode="pipe", intervals=intervals, prescale="lanczos", static_frames=StaticFrameSkip())
+        editor.process_video()
+    return final_video_path, tracer.to_dict()
+
+async def print_progress(progress: ProgressStream):
+    async for d in progress:
+        VideoTools.progress_hook_yt(d)
+
+async def download_intervals(url: str, video_dir: str, intervals: list[tuple[int, int]], reduced_subtitles_path: str,
+                             progress: Optional[ProgressStream] = None) -> Optional[tuple[str, list[tuple[int, int]], str]]:
+    """
+    Fetches only the parts of the episode around the selected intervals. Returns the video, with the intervals
+    and the selected subtitles moved onto its timeline. None if the download failed.
+    """
+    sections = await VideoTools.download_yt_sections(url, video_dir, intervals, progress=progress)
+    if sections is None:
+        return None
+    video_path, time_map = sections
+    video_intervals = [time_map.map_span(start, end) for start, end in intervals]
+    return video_path, video_intervals, CSVUtils.offset_csv_file_timestamps(reduced_subtitles_path, time_map)
+
+async def transcribe(job: Job) -> Job:
+    os.makedirs(job.video_dir, exist_ok=True)
+    try:
+        with job.tracer.span("subtitles"):
+            job.subtitles_path = await VideoTools.download_yt_subtitles(job.url, job.video_dir)
+            if job.subtitles_path is None:
+                raise RuntimeError("subtitles download failed")
+    finally:
+        job.write_trace()
+    return job
+
+async def select(job: Job) -> Job:
+    try:
+        with job.tracer.span("llm_selection"):
+            job.reduced_subtitles_path = await asyncio.to_thread(LLM.generate_script_gemini, job.video_dir, job.subtitles_path)
+            job.intervals = select_intervals(job.reduced_subtitles_path)
+            if not job.intervals:
+                raise RuntimeError("no intervals selected")
+    finally:
+        job.write_trace()
+    return job
+
+async def download(job: Job) -> Job:
+    progress = ProgressStream()
+    printer = asyncio.create_task(print_progress(progress))
+    try:
+        with job.tracer.span("download"):
+            try:
+                downloaded = await download_intervals(job.url, job.video_dir, job.intervals, job.reduced_subtitles_path, progress)
+            finally:
+                # Ends the printer however the download ended, a cancel of this task cancels it too
+                progress.close()
+                await printer
+            if downloaded is None:
+                raise RuntimeError("download failed")
+            job.video_path, job.intervals, job.reduced_subtitles_path = downloaded
+    finally:
+        job.write_trace()
+    return job
+
+async def render(job: Job, render_pool: Executor) -> Job:
+    loop = asyncio.get_running_loop()
+    try:
+        with job.tracer.span("render"):
+            job.final_video_path, render_trace = await loop.run_in_executor(render_pool, render_short, job.video_dir, job.video_path, job.reduced_subtitles_path, job.intervals)
+            tracing.attach(render_trace)
+        job.tracer.close()
+    finally:
+        job.write_trace()
+    print(f"Rendered {job.url}: {job.final_video_path}")
+    return job
+
+async def perform_work(video_urls: list[str], transcript_concurrency: int = TRANSCRIPT_CONCURRENCY, llm_concurrency: int = LLM_CONCURRENCY,
+                       download_concurrency: int = DOWNLOAD_CONCURRENCY, render_concurrency: int = RENDER_CONCURRENCY):
+    """
+    Runs every url through transcript -> LLM selection -> download -> render. The transcript is all the LLM
+    needs, so only the selected parts of the episode are downloaded. The stages overlap, so the next
+    episode downloads while the current one renders, and each stage has its own concurrency limit.
+    """
+    data_folder = f"processed_data"
+    jobs = []
     for url in video_urls:
+        # One malformed url is skipped, it doesn't stop the rest of the batch
         try:
             slug = VideoTools.get_slug_from_yt_video_url(url)
-            data_folder = f"processed_data"
-            video_dir = data_folder+"/"+slug
- 
-            results = await asyncio.gather(
-                VideoTools.download_yt_video(url, video_dir), 
-                VideoTools.download_yt_subtitles(url, video_dir)
-            )
-
-            [video_path, subtitles_path] = results
-
-            reduced_subtitles_path = LLM.generate_script_gemini(video_dir, subtitles_path)
-
-            output_video_path = video_dir + "/final_video.mp4"
-            intervals = merge_intervals(get_intervals(reduced_subtitles_path))
-            clip_video(video_path, intervals, output_video_path)
-            offsetted_subtitles = CSVUtils.offset_csv_file_timestamps(reduced_subtitles_path)
-            final_video_path = video_dir+"/final_video_subbed.mp4"
-            
-            editor = VideoEditor(video_dir, output_video_path, output_path=final_video_path, subtitles=Subtitles(offsetted_subtitles))
-            editor.process_video()
-        except Exception as e:
-            print(f"error processing {url}: ", e)
+        except (KeyError, IndexError) as e:
+            print(f"Skipping {url}, no video id in the url: ", e)
             continue
+        jobs.append(Job(url, data_folder+"/"+slug))
+
+    with ProcessPoolExecutor(render_concurrency) as render_pool:
+        pipeline = Pipeline([
+            Stage("transcript", transcribe, transcript_concurrency),
+            Stage("llm", select, llm_concurrency),
+            Stage("download", download, download_concurrency),
+            Stage("render", partial(render, render_pool=render_pool), render_concurrency),
+        ])
+        return await pipeline.run(jobs)
 
 if __name__ == "__main__":
     yt_video_urls = [
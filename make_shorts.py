@@ -1,13 +1,35 @@
+import bisect
 import csv
+import math
+import shutil
 import subprocess
 import os
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import cv2
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageEnhance
 import multiprocessing as mp
-from functools import partial
+import copy
+from collections import deque
+from artifact_cache import artifact_cache
+from compositor import OUTPUT_WIDTH, OUTPUT_HEIGHT, BackgroundStage, PortraitGeometry, get_compositor, working_resolution
+from filtergraph import build_portrait_filtergraph, frame_ranges_to_ms, write_ass_subtitles
+from captions import get_caption_renderer
+from frame_ring import FrameRing
+from frame_reader import PRESCALE_FILTERS, FfmpegFrameReader, prescale_filter
+from static_frames import StaticFrameDetector, StaticFrameSkip
+import tracing
+from tracing import process_tree_rss
+from clip_new import create_concat_file
+from utils import get_keyframe_index, merge_intervals
+
+RENDER_MODES = ["png", "pipe", "segments", "filtergraph"]
+COMPOSITORS = ["pil", "cv2"]
+TRANSPORTS = ["pickle", "shm"]
+
+# Gaps between intervals shorter than this are decoded through instead of seeked over
+SEEK_GAP_SECONDS = 2
 
 @dataclass
 class SubtitleEntry:
@@ -15,10 +37,41 @@ class SubtitleEntry:
     start_ms: int
     end_ms: int
 
+class SubtitleCursor:
+    """
+    Active cues for monotonically increasing timestamps, e.g. consecutive frames.
+    Each cue is added and dropped once, so a whole render costs amortized O(1) per frame.
+    Going back in time re-seeks through the index.
+    """
+    def __init__(self, subtitles: "Subtitles"):
+        self.subtitles = subtitles
+        self._next = 0
+        self._active: list[int] = []
+        self._last_timestamp = None
+
+    def at(self, timestamp_ms: int) -> List[SubtitleEntry]:
+        subtitles = self.subtitles
+        if self._last_timestamp is not None and timestamp_ms < self._last_timestamp:
+            self._next = 0
+            self._active = []
+        self._last_timestamp = timestamp_ms
+
+        order = subtitles._order_by_start
+        while self._next < len(order) and subtitles._starts[self._next] <= timestamp_ms:
+            self._active.append(order[self._next])
+            self._next += 1
+
+        entries = subtitles.entries
+        self._active = [idx for idx in self._active if entries[idx].end_ms >= timestamp_ms]
+
+        return [entries[idx] for idx in sorted(self._active)]
+
+
 class Subtitles:
     def __init__(self, subtitle_file: str):
         self.entries: List[SubtitleEntry] = []
         self._load_subtitles(subtitle_file)
+        self._build_index()
     
     def _load_subtitles(self, subtitle_file: str) -> None:
         with open(subtitle_file, 'r', encoding='utf-8') as file:
@@ -31,21 +84,129 @@ class Subtitles:
                 )
                 self.entries.append(entry)
     
-    def get_subtitles_at_time(self, timestamp_ms: int) -> Optional[str]:
-        entries = []
-        for entry in self.entries:
-            if entry.start_ms <= timestamp_ms <= entry.end_ms:
-                entries.append(entry)
-        
-        return entries
+    def _build_index(self) -> None:
+        """Entries sorted by start time, plus the longest cue, so a lookup only scans cues that can still be on screen."""
+        self._order_by_start = sorted(range(len(self.entries)), key=lambda idx: self.entries[idx].start_ms)
+        self._starts = [self.entries[idx].start_ms for idx in self._order_by_start]
+        self._max_duration = max((entry.end_ms - entry.start_ms for entry in self.entries), default=0)
+
+    def get_subtitles_at_time(self, timestamp_ms: int) -> List[SubtitleEntry]:
+        # Every cue starting after timestamp_ms is skipped by the bisect, and every cue
+        # starting before timestamp_ms - max_duration has already ended
+        matches = []
+        pos = bisect.bisect_right(self._starts, timestamp_ms) - 1
+        while pos >= 0 and self._starts[pos] >= timestamp_ms - self._max_duration:
+            idx = self._order_by_start[pos]
+            if self.entries[idx].end_ms >= timestamp_ms:
+                matches.append(idx)
+            pos -= 1
+
+        # Keep the file order the linear scan used to return
+        return [self.entries[idx] for idx in sorted(matches)]
+
+    def cursor(self) -> SubtitleCursor:
+        return SubtitleCursor(self)
+
+
+# Set once per worker by the pool initializer
+_worker_editor: Optional["VideoEditor"] = None
+_worker_rings: Optional[tuple[FrameRing, Optional[FrameRing]]] = None
+
+def _init_render_worker(editor: "VideoEditor", ring_args=None) -> None:
+    global _worker_editor, _worker_rings
+    _worker_editor = editor
+    if ring_args is not None:
+        input_args, output_args = ring_args
+        _worker_rings = (FrameRing(*input_args), FrameRing(*output_args) if output_args else None)
+
+def _render_segment_task(segment):
+    static_hits = _worker_editor.static_frame_hits
+    chunk_path, rendered = _worker_editor.render_segment(*segment)
+    return chunk_path, rendered, _worker_editor.static_frame_hits - static_hits, tracing.drain_histograms()
+
+def _render_chunk(chunk, temp_dir):
+    """Returns the chunk's results and the frame timings when tracing."""
+    if _worker_rings is None:
+        results = [_worker_editor.process_frame(frame_data, temp_dir) for frame_data in chunk]
+        return results, tracing.drain_histograms()
+
+    # shm transport - frames are read from, and rendered into, the slot named in the task
+    input_ring, output_ring = _worker_rings
+    slots = []
+    for frame_number, timestamp_ms, slot, subtitle_texts in chunk:
+        output = output_ring.slot(slot) if output_ring is not None else None
+        _worker_editor.process_frame((frame_number, timestamp_ms, input_ring.slot(slot), subtitle_texts), temp_dir, output)
+        slots.append(slot)
+    return slots, tracing.drain_histograms()
 
 
 class VideoEditor:
-    def __init__(self, video_root_folder:str, video_path: str, output_path: str, subtitles: Subtitles, font_path: str = "fonts/komika-axis/KOMIKAX_.ttf", font_size:int = 42):
+    def __init__(self, video_root_folder:str, video_path: str, output_path: str, subtitles: Subtitles, font_path: str = "fonts/komika-axis/KOMIKAX_.ttf", font_size:int = 42, render_mode: str = "png", compositor: str = "pil", background_stage: Optional[BackgroundStage] = None, max_in_flight: Optional[int] = None, chunk_size: int = 4, transport: str = "pickle", num_segments: Optional[int] = None, intervals: Optional[List[Tuple[int, int]]] = None, prescale: Optional[str] = None, static_frames: Optional[StaticFrameSkip] = None):
+        """
+        render_mode:
+            "png"  - every worker saves temp_frames/frame_%06d.png, then a second ffmpeg pass encodes them
+            "pipe" - ordered raw rgb24 frames are streamed into a single ffmpeg process over stdin
+            "segments" - the clip is split at keyframes, every worker decodes, renders and encodes its
+                         own range, and the chunks are stitched with the concat demuxer.
+                         num_segments defaults to one per worker.
+            "filtergraph" - the whole layout runs as one ffmpeg filtergraph with ASS captions,
+                            no frames cross into Python. compositor does not apply.
+        compositor:
+            "pil" - the original PIL chain in render_frame
+            "cv2" - Cv2Compositor, works on the BGR ndarray with preallocated output buffers
+        background_stage:
+            cv2 compositor only. Blur the background at low resolution and reuse it across static frames.
+        max_in_flight, chunk_size:
+            at most max_in_flight chunks of chunk_size frames are decoded and waiting on workers at once.
+            Defaults to two chunks per worker.
+        intervals:
+            merged (start_ms, end_ms) ranges of video_path to keep. When given, video_path is the source
+            video and subtitles use its timeline: only frames inside the intervals are decoded, the audio
+            is trimmed to the same frames, and everything is encoded once - no clip_video pass needed.
+        transport:
+            "pickle" - decoded and rendered frames are pickled through the pool's pipes
+            "shm"    - frames live in shared memory rings, workers only receive slot indices
+        prescale:
+            swscale filter from PRESCALE_FILTERS. Frames are decoded through ffmpeg and scaled to the working
+            resolution (the zoomed foreground width) before reaching Python, so a 4K source is never
+            handled at 4K. None decodes at full resolution with cv2.
+        static_frames:
+            reuse the previous rendered frame while the source stays still and the captions don't change,
+            see StaticFrameSkip. None renders every frame. Does not apply to "filtergraph".
+        """
+        if render_mode not in RENDER_MODES:
+            raise ValueError(f"Unknown render_mode {render_mode}, expected one of {RENDER_MODES}")
+        if compositor not in COMPOSITORS:
+            raise ValueError(f"Unknown compositor {compositor}, expected one of {COMPOSITORS}")
+        if background_stage is not None and compositor != "cv2":
+            raise ValueError("background_stage requires the cv2 compositor")
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown transport {transport}, expected one of {TRANSPORTS}")
+        if intervals is not None and render_mode == "segments":
+            raise ValueError("intervals are not supported by the segments render mode")
+        if prescale is not None and prescale not in PRESCALE_FILTERS:
+            raise ValueError(f"Unknown prescale {prescale}, expected one of {PRESCALE_FILTERS}")
+
         self.video_path = video_path
+        self.render_mode = render_mode
+        self.compositor = compositor
+        self.background_stage = background_stage
+        self.max_in_flight = max_in_flight
+        self.chunk_size = chunk_size
+        self.transport = transport
+        self.num_segments = num_segments
+        self.intervals = intervals
+        self.prescale = prescale
+        # Decoded width / source width, the blur radius shrinks with it so the background looks the same
+        self.decode_scale = 1.0
+        self.static_frames = static_frames
+        self.static_frame_hits = 0
+        self.peak_rss_bytes = 0
         self.output_path = output_path
         self.subtitles = subtitles
         self.temp_dir = video_root_folder+"/temp_frames"
+        self.font_path = font_path
+        self.font_size = font_size
         self.font = ImageFont.truetype(font_path, font_size)
         self.shadow_color = (128, 128, 128)
         self.blur_radius = 30
@@ -54,55 +215,433 @@ class VideoEditor:
         self.explosion_factor = 2
         self.zoom_factor = 1.9
         
-        # Create temp directory if it doesn't exist
-        os.makedirs(self.temp_dir, exist_ok=True)
+        # Create temp directory if it doesn't exist. The pipe mode never touches disk.
+        if self.render_mode in ("png", "segments", "filtergraph"):
+            os.makedirs(self.temp_dir, exist_ok=True)
 
-    def _extract_frames(self) -> tuple[int, float]:
+    def _working_size(self, source_size: tuple[int, int]) -> tuple[int, int]:
+        if self.prescale is None:
+            return source_size
+        return working_resolution(*source_size, self.zoom_factor)
+
+    def _open_capture(self):
+        """cv2.VideoCapture on the source, or an FfmpegFrameReader at the working resolution when prescaling."""
         cap = cv2.VideoCapture(self.video_path)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        source_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        size = self._working_size(source_size)
+        if size == source_size:
+            return cap
+
+        cap.release()
+        self.decode_scale = size[0] / source_size[0]
+        return FfmpegFrameReader(self.video_path, size, self.prescale)
+
+    def _source_frame_ranges(self, fps: float) -> list[tuple[int, int]]:
+        """Source frames [start, end) to render. Frame n is shown at n / fps, so it belongs to an interval when start_ms <= n / fps < end_ms."""
+        if self.intervals is None:
+            return [(0, math.inf)]
+
+        ranges = []
+        for start_ms, end_ms in self.intervals:
+            start_frame = math.ceil(start_ms * fps / 1000)
+            end_frame = math.ceil(end_ms * fps / 1000)
+            if end_frame > start_frame:
+                ranges.append((start_frame, end_frame))
+        return ranges
+
+    @staticmethod
+    def _decode_ranges(cap, fps: float, ranges: list[tuple[int, int]]):
+        """
+        Yields (source frame number, frame) for the sorted frame ranges. Frames in between are skipped:
+        short gaps are grabbed without decoding, longer ones are seeked over.
+        """
+        position = 0
+        for start_frame, end_frame in ranges:
+            if start_frame - position > SEEK_GAP_SECONDS * fps:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+                position = start_frame
+            while position < start_frame:
+                if not cap.grab():
+                    return
+                position += 1
+
+            while position < end_frame:
+                decode_start = tracing.now()
+                ret, frame = cap.read()
+                tracing.observe("decode", decode_start)
+                if not ret:
+                    return
+                yield position, frame
+                position += 1
+
+    def _frame_generator(self, cap, fps: float):
+        """Yields (output frame number, source timestamp, frame, active cues) for the frames inside self.intervals."""
+        # Active cues are resolved here with a cursor, so workers never need the Subtitles object
+        cursor = self.subtitles.cursor()
+
+        for frame_number, (position, frame) in enumerate(self._decode_ranges(cap, fps, self._source_frame_ranges(fps))):
+            timestamp_ms = int((position / fps) * 1000)
+            yield (frame_number, timestamp_ms, frame, cursor.at(timestamp_ms))
+
+    def _dispatch_frames(self, cap, fps: float, temp_dir: Optional[str], handle_result=None, frames=None) -> int:
+        """
+        Feed decoded frames to the worker pool in chunks of chunk_size, with at most max_in_flight
+        chunks decoded or rendering at any time. Results are handed to handle_result in frame order.
+        frames replaces _frame_generator as the source of (frame number, timestamp, frame, cues) tasks.
+        Memory stays flat however long the video is, unlike pool.imap which drains the decoder
+        into its task queue as fast as cap.read() allows.
+        Static frames are detected here, where the frames are in timeline order. They never reach a
+        worker, the previous output is repeated in their place when the results are drained.
+        """
+        # Use all available CPU cores minus 1
+        num_processes = max(1, mp.cpu_count() - 1)
+        max_in_flight = self.max_in_flight or 2 * num_processes
+        self._prewarm_captions()
+
+        # The editor travels to each worker once, through the pool initializer, instead of with every task
+        worker_editor = copy.copy(self)
+        worker_editor.subtitles = None
+
+        # (async result or None when every frame was static, [(frame number, static)]) per chunk
+        pending = deque()
+        frame_count = 0
+        self.peak_rss_bytes = 0
+        self.static_frame_hits = 0
+        detector = StaticFrameDetector(self.static_frames) if self.static_frames is not None else None
+        # Output of the last rendered frame, its png path or rgb24 bytes, repeated for static frames
+        last_output = None
+
+        input_ring, output_ring = self._open_frame_rings(cap, max_in_flight * self.chunk_size, temp_dir is None)
+        ring_args = None
+        if input_ring is not None:
+            ring_args = (input_ring.attach_args(), output_ring.attach_args() if output_ring is not None else None)
+
+        def drain_oldest():
+            nonlocal last_output
+            job, layout = pending.popleft()
+            results, timings = job.get() if job is not None else ([], None)
+            tracing.merge_histograms(timings)
+            results = iter(results)
+            for frame_number, static in layout:
+                if static:
+                    result = last_output
+                    if temp_dir is not None:
+                        shutil.copyfile(last_output, f"{temp_dir}/frame_{frame_number:06d}.png")
+                else:
+                    result = next(results)
+                    if output_ring is not None:
+                        # The worker returned the slot its rgb24 frame was rendered into
+                        result = output_ring.buffer(result)
+                    if detector is not None:
+                        # A slot is handed to a later frame once drained, so its pixels are copied out
+                        last_output = f"{temp_dir}/frame_{frame_number:06d}.png" if temp_dir is not None else bytes(result)
+                if handle_result is None:
+                    continue
+                write_start = tracing.now()
+                handle_result(result)
+                tracing.observe("write", write_start)
+            self.peak_rss_bytes = max(self.peak_rss_bytes, process_tree_rss())
+
+        def submit(chunk, layout):
+            pending.append((pool.apply_async(_render_chunk, (chunk, temp_dir)) if chunk else None, layout))
+
+        try:
+            with mp.Pool(num_processes, initializer=_init_render_worker, initargs=(worker_editor, ring_args)) as pool:
+                chunk, layout = [], []
+                for frame_data in frames if frames is not None else self._frame_generator(cap, fps):
+                    frame_number, timestamp_ms, frame, subtitle_texts = frame_data
+                    frame_count += 1
+                    static = detector is not None and detector.is_repeat(frame, tuple(text.text for text in subtitle_texts))
+                    layout.append((frame_number, static))
+                    if static:
+                        self.static_frame_hits += 1
+                    else:
+                        if input_ring is not None:
+                            # Every in-flight frame owns one slot, the window guarantees a slot is
+                            # drained before frame_number wraps around to it again
+                            slot = frame_number % input_ring.slots
+                            np.copyto(input_ring.slot(slot), frame)
+                            frame_data = (frame_number, timestamp_ms, slot, subtitle_texts)
+                        chunk.append(frame_data)
+                    if len(layout) < self.chunk_size:
+                        continue
+
+                    submit(chunk, layout)
+                    chunk, layout = [], []
+                    while len(pending) >= max_in_flight:
+                        drain_oldest()
+
+                if layout:
+                    submit(chunk, layout)
+                while pending:
+                    drain_oldest()
+        finally:
+            for ring in (input_ring, output_ring):
+                if ring is not None:
+                    ring.close()
+
+        print(f"Rendered {frame_count} frames, peak memory {self.peak_rss_bytes / 1024 / 1024:.0f} MB")
+        self._report_static_frames(frame_count)
+        return frame_count
+
+    def _open_frame_rings(self, cap, slots: int, with_output: bool) -> tuple[Optional[FrameRing], Optional[FrameRing]]:
+        """Shared memory rings for the shm transport: decoded frames in, rendered rgb24 frames out."""
+        if self.transport != "shm":
+            return None, None
+
+        frame_shape = (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+        input_ring = FrameRing(slots, frame_shape)
+        output_ring = FrameRing(slots, (OUTPUT_HEIGHT, OUTPUT_WIDTH, 3)) if with_output else None
+        return input_ring, output_ring
+
+    def _report_static_frames(self, frame_count: int) -> None:
+        if self.static_frames is None or frame_count == 0:
+            return
+        print(f"Static frames reused: {self.static_frame_hits}/{frame_count} ({self.static_frame_hits / frame_count:.1%})")
+
+    def _extract_frames(self) -> tuple[int, float]:
+        cap = self._open_capture()
         fps = cap.get(cv2.CAP_PROP_FPS)
-        
-        # Create frame data generator
-        def frame_generator():
-            frame_number = 0
-            while True:
+
+        try:
+            frame_count = self._dispatch_frames(cap, fps, self.temp_dir)
+        finally:
+            cap.release()
+
+        return frame_count, fps
+
+    def _prewarm_captions(self, subtitles: Optional[List[Subtitles]] = None) -> None:
+        """Rasterize caption sprites in the parent so forked workers start with a warm cache."""
+        if self.compositor == "cv2":
+            for source in subtitles or [self.subtitles]:
+                get_caption_renderer(self.font_path, self.font_size).prewarm(entry.text for entry in source.entries)
+
+    def _stream_frames(self) -> tuple[int, float]:
+        """
+        Render frames in parallel and write them, in order, straight into ffmpeg's stdin.
+        The encoder muxes the source audio in the same process, so no intermediate files are written.
+        """
+        cap = self._open_capture()
+        fps = cap.get(cv2.CAP_PROP_FPS)
+
+        encoder = subprocess.Popen(self._pipe_encoder_cmd(fps), stdin=subprocess.PIPE)
+
+        try:
+            frame_count = self._dispatch_frames(cap, fps, None, encoder.stdin.write)
+        finally:
+            cap.release()
+            encoder.stdin.close()
+            return_code = encoder.wait()
+
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, encoder.args)
+
+        return frame_count, fps
+    
+    def _plan_segments(self, num_segments: int) -> tuple[list[tuple[int, int]], int]:
+        """
+        Split the video into about num_segments frame ranges [start, end), each starting on a keyframe
+        so a worker can seek straight to it and decode exactly its own frames.
+        """
+        keyframes, frame_count = get_keyframe_index(self.video_path)
+
+        boundaries = set()
+        for i in range(1, num_segments):
+            target = frame_count * i // num_segments
+            next_keyframe = bisect.bisect_left(keyframes, target)
+            if next_keyframe < len(keyframes) and 0 < keyframes[next_keyframe] < frame_count:
+                boundaries.add(keyframes[next_keyframe])
+
+        edges = [0] + sorted(boundaries) + [frame_count]
+        return list(zip(edges[:-1], edges[1:])), frame_count
+
+    def render_segment(self, segment_idx: int, start_frame: int, end_frame: int, fps: float) -> tuple[str, int]:
+        """Decode, render and encode frames [start_frame, end_frame) into a video only chunk."""
+        chunk_path = f"{self.temp_dir}/segment_{segment_idx:04d}.mp4"
+
+        cap = self._open_capture()
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        cursor = self.subtitles.cursor()
+        # A worker renders its segment in order, so it can detect static frames itself, from a fresh start
+        detector = StaticFrameDetector(self.static_frames) if self.static_frames is not None else None
+        result = None
+
+        encoder = subprocess.Popen([
+            'ffmpeg',
+            '-y',
+            '-loglevel', 'error',
+            '-f', 'rawvideo',
+            '-pix_fmt', 'rgb24',
+            '-s', f'{OUTPUT_WIDTH}x{OUTPUT_HEIGHT}',
+            '-framerate', str(fps),
+            '-i', '-',
+        ] + self._video_codec_args() + [chunk_path], stdin=subprocess.PIPE)
+
+        rendered = 0
+        try:
+            for frame_number in range(start_frame, end_frame):
+                decode_start = tracing.now()
                 ret, frame = cap.read()
+                tracing.observe("decode", decode_start)
                 if not ret:
                     break
                 timestamp_ms = int((frame_number / fps) * 1000)
-                yield (frame_number, timestamp_ms, frame)
-                frame_number += 1
+                subtitle_texts = cursor.at(timestamp_ms)
+                if detector is not None and detector.is_repeat(frame, tuple(text.text for text in subtitle_texts)):
+                    self.static_frame_hits += 1
+                else:
+                    result = self.process_frame((frame_number, timestamp_ms, frame, subtitle_texts), None)
+                write_start = tracing.now()
+                encoder.stdin.write(result)
+                tracing.observe("write", write_start)
+                rendered += 1
+        finally:
+            cap.release()
+            encoder.stdin.close()
+            return_code = encoder.wait()
+
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, encoder.args)
+
+        return chunk_path, rendered
+
+    def _render_segments(self) -> tuple[int, float]:
+        cap = self._open_capture()
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        cap.release()
 
         # Use all available CPU cores minus 1
         num_processes = max(1, mp.cpu_count() - 1)
-        
-        with mp.Pool(num_processes) as pool:
-            process_func = partial(self.process_frame, temp_dir=self.temp_dir, subtitles=self.subtitles)
-            # Process frames in parallel
-            list(pool.imap(process_func, frame_generator()))
-        
+        segments, expected_frames = self._plan_segments(self.num_segments or num_processes)
+        print(f"Rendering {len(segments)} segments: {segments}")
+
+        self._prewarm_captions()
+        with mp.Pool(num_processes, initializer=_init_render_worker, initargs=(self,)) as pool:
+            results = pool.map(_render_segment_task, [(idx, start, end, fps) for idx, (start, end) in enumerate(segments)])
+
+        for _, _, _, timings in results:
+            tracing.merge_histograms(timings)
+        for (start, end), (chunk_path, rendered, _, _) in zip(segments, results):
+            if rendered != end - start:
+                raise RuntimeError(f"{chunk_path} has {rendered} frames, expected {end - start}")
+
+        frame_count = sum(rendered for _, rendered, _, _ in results)
+        self.static_frame_hits = sum(static_hits for _, _, static_hits, _ in results)
+        self._report_static_frames(frame_count)
+        if frame_count != expected_frames:
+            raise RuntimeError(f"Rendered {frame_count} frames, source has {expected_frames}")
+
+        concat_file = f"{self.temp_dir}/segments.txt"
+        create_concat_file([chunk_path for chunk_path, _, _, _ in results], concat_file)
+        subprocess.run([
+            'ffmpeg',
+            '-y',
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', concat_file,
+            '-i', self.video_path,
+            '-map', '0:v:0',
+            '-map', '1:a:0',
+            '-c', 'copy',
+            self.output_path
+        ], check=True)
+
+        return frame_count, fps
+
+    def _render_filtergraph(self) -> tuple[int, float]:
+        """
+        Runs the whole portrait layout as a single ffmpeg process: the filtergraph from
+        build_portrait_filtergraph plus an ASS file generated from the subtitles.
+        """
+        cap = cv2.VideoCapture(self.video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        source_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         cap.release()
+
+        # With prescale the graph starts with a scale to the working resolution, everything after it is sized for that
+        working_size = self._working_size(source_size)
+        prescale = prescale_filter(working_size, self.prescale) if working_size != source_size else None
+        blur_radius = self.blur_radius * working_size[0] / source_size[0]
+
+        geometry = PortraitGeometry.for_source(*working_size, self.explosion_factor, self.zoom_factor)
+        ranges = self._source_frame_ranges(fps)
+
+        subtitles_file = write_ass_subtitles(f"{self.temp_dir}/captions.ass", self.subtitles.entries, frame_ranges_to_ms(ranges, fps),
+                                             self.font, geometry.caption_top)
+        filter_graph = build_portrait_filtergraph(working_size, geometry, blur_radius, self.brightness_factor, subtitles_file,
+                                                  os.path.dirname(os.path.abspath(self.font_path)), ranges if self.intervals is not None else None,
+                                                  prescale, fps)
+
+        if self.intervals is None:
+            audio_args = ['-map', '0:a:0', '-c:a', 'copy']
+        else:
+            filter_graph += ";" + self._audio_trim_graph(fps, '0:a:0')
+            audio_args = ['-map', '[aout]', '-c:a', 'aac']
+            frame_count = sum(end_frame - start_frame for start_frame, end_frame in ranges)
+
+        ffmpeg_cmd = [
+            'ffmpeg',
+            '-y',
+            '-i', self.video_path,
+            '-filter_complex', filter_graph,
+            '-map', '[vout]',
+        ] + audio_args + self._video_codec_args() + [self.output_path]
+
+        subprocess.run(ffmpeg_cmd, check=True)
+
         return frame_count, fps
-    
-    def process_frame(self, frame_data, temp_dir, subtitles):
-        frame_number, timestamp_ms, frame = frame_data
 
+    def process_frame(self, frame_data, temp_dir, output: Optional[np.ndarray] = None):
+        """
+        Renders one frame. With temp_dir it is saved as a png, otherwise the rgb24 frame is
+        returned as bytes, or written into output (a shared memory slot) when one is given.
+        """
+        frame_number, timestamp_ms, frame, subtitle_texts = frame_data
+        frame_path = f"{temp_dir}/frame_{frame_number:06d}.png" if temp_dir is not None else None
+        return self._render_frame_output(frame, subtitle_texts, frame_path, output, frame_number)
+
+    def _render_frame_output(self, frame: np.ndarray, subtitle_texts: list[SubtitleEntry], frame_path: Optional[str], output: Optional[np.ndarray], frame_number: Optional[int] = None):
+        if self.compositor == "cv2":
+            rendered = self.render_frame_cv2(frame, subtitle_texts, frame_number)
+            if frame_path is None:
+                # rgb24 rather than bgr24 keeps the encoder's colour conversion identical to the png path
+                if output is not None:
+                    cv2.cvtColor(rendered, cv2.COLOR_BGR2RGB, dst=output)
+                    return
+                return cv2.cvtColor(rendered, cv2.COLOR_BGR2RGB).tobytes()
+            write_start = tracing.now()
+            cv2.imwrite(frame_path, rendered)
+            tracing.observe("write", write_start)
+            return
 
         # Convert frame from BGR to RGB
         frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         pil_image = Image.fromarray(frame_rgb)
-        
-        # Get subtitle for this timestamp
-        subtitle_texts = subtitles.get_subtitles_at_time(timestamp_ms)
-        
-        self.resize_and_add_text_to_frame(pil_image, subtitle_texts, f"{temp_dir}/frame_{frame_number:06d}.png")
+
+        if frame_path is None:
+            # pipe mode - hand the raw buffer back to the parent
+            image = self.render_frame(pil_image, subtitle_texts)
+            if output is not None:
+                output[:] = np.asarray(image)
+                return
+            return image.tobytes()
+
+        self.resize_and_add_text_to_frame(pil_image, subtitle_texts, frame_path)
     
     def resize_and_add_text_to_frame(self, image: Image.Image, texts: list[SubtitleEntry], save_frame_dir: str) -> None:
+        image = self.render_frame(image, texts)
+        write_start = tracing.now()
+        image.save(save_frame_dir)
+        tracing.observe("write", write_start)
+
+    def render_frame(self, image: Image.Image, texts: list[SubtitleEntry]) -> Image.Image:
+        composite_start = tracing.now()
         original_width, original_height = image.size
 
         img = image.copy()
 
-        image = image.filter(ImageFilter.GaussianBlur(radius=self.blur_radius))
+        image = image.filter(ImageFilter.GaussianBlur(radius=self.blur_radius * self.decode_scale))
         new_width_exploded = int(self.explosion_factor*1920*1920/1080)
         new_height_exploded = 1920 * self.explosion_factor
         image = image.resize((new_width_exploded, new_height_exploded))
@@ -123,11 +662,38 @@ class VideoEditor:
         paste_y = (1920 - new_height) // 2
 
         image.paste(resized_img, (0, paste_y))
+        tracing.observe("composite", composite_start)
 
+        text_start = tracing.now()
         draw = ImageDraw.Draw(image)
+        self._draw_texts(draw, texts, image.size[1]//2 + new_height//2)
+        tracing.observe("text", text_start)
         
-        resized_img_w = 1080
-        resized_img_h = new_height
+        return image
+
+    def render_frame_cv2(self, frame: np.ndarray, texts: list[SubtitleEntry], frame_number: Optional[int] = None) -> np.ndarray:
+        """
+        Same layout as render_frame, built by Cv2Compositor straight from the BGR frame.
+        Returns the compositor's BGR output buffer, which is reused for the next frame.
+        frame_number tells the compositor which frames follow on from each other in the timeline.
+        """
+        composite_start = tracing.now()
+        compositor = get_compositor(self.blur_radius * self.decode_scale, self.brightness_factor, self.explosion_factor, self.zoom_factor, self.background_stage)
+        output = compositor.composite(frame, frame_number)
+        tracing.observe("composite", composite_start)
+
+        if texts:
+            text_start = tracing.now()
+            # Cached caption sprites are blended straight onto the buffer. Black/white captions
+            # look the same in BGR and RGB, so no conversion is needed.
+            caption_top = OUTPUT_HEIGHT//2 + compositor.fg_height//2
+            get_caption_renderer(self.font_path, self.font_size).draw(output, [text.text for text in texts], caption_top)
+            tracing.observe("text", text_start)
+
+        return output
+
+    def _draw_texts(self, draw: ImageDraw.ImageDraw, texts: list[SubtitleEntry], caption_top: int) -> None:
+        resized_img_w = OUTPUT_WIDTH
         line_spacing = 15  # Space between lines
         
         # Calculate total height needed for all texts
@@ -143,7 +709,7 @@ class VideoEditor:
         
         # Start position for the first line
         offset = 15
-        current_y = image.size[1]//2 + resized_img_h//2 + offset
+        current_y = caption_top + offset
         
         # Draw each line of text
         for text, (text_width, text_height) in zip(texts, text_sizes):
@@ -153,9 +719,42 @@ class VideoEditor:
             draw.text((x, current_y), text.text, font=self.font, fill="white", stroke_width=1)
             
             current_y += text_height + line_spacing
-        
-        image.save(save_frame_dir)
 
+    def _video_codec_args(self) -> list[str]:
+        return [
+            '-c:v', 'libx264',
+            '-pix_fmt', 'yuv420p',
+            '-preset', 'medium',
+            '-crf', '23',
+        ]
+
+    def _audio_trim_graph(self, fps: float, audio_stream: str) -> str:
+        """Cuts the source audio to exactly the rendered frames, so it stays in sync with the video. Writes [aout]."""
+        ranges = self._source_frame_ranges(fps)
+        trims = [
+            f"[{audio_stream}]atrim=start={start_frame / fps}:end={end_frame / fps},asetpts=PTS-STARTPTS[a{idx}]"
+            for idx, (start_frame, end_frame) in enumerate(ranges)
+        ]
+        labels = "".join(f"[a{idx}]" for idx in range(len(ranges)))
+        return ";".join(trims) + f";{labels}concat=n={len(ranges)}:v=0:a=1[aout]"
+
+    def _audio_args(self, fps: float) -> list[str]:
+        if self.intervals is None:
+            return [
+                '-c:a', 'copy',         # Copy audio without re-encoding
+                '-map', '0:v:0',        # Use video from first input (frames)
+                '-map', '1:a:0',        # Use audio from second input (original video)
+            ]
+
+        return [
+            '-filter_complex', self._audio_trim_graph(fps, '1:a:0'),
+            '-map', '0:v:0',
+            '-map', '[aout]',
+            '-c:a', 'aac',
+        ]
+
+    def _encoder_output_args(self, fps: float) -> list[str]:
+        return self._video_codec_args() + self._audio_args(fps) + [self.output_path]
 
     def _combine_frames(self, frame_count: int, fps: float) -> None:
         ffmpeg_cmd = [
@@ -164,46 +763,182 @@ class VideoEditor:
             '-framerate', str(fps),
             '-i', f'{self.temp_dir}/frame_%06d.png',
             '-i', self.video_path,  # Add original video as second input
-            '-c:v', 'libx264',
-            '-c:a', 'copy',         # Copy audio without re-encoding
-            '-map', '0:v:0',        # Use video from first input (frames)
-            '-map', '1:a:0',        # Use audio from second input (original video)
-            '-pix_fmt', 'yuv420p',
-            '-preset', 'medium',
-            '-crf', '23',
-            self.output_path
-        ]
+        ] + self._encoder_output_args(fps)
         
         subprocess.run(ffmpeg_cmd, check=True)
+
+    def _pipe_encoder_cmd(self, fps: float) -> list[str]:
+        return [
+            'ffmpeg',
+            '-y',
+            '-f', 'rawvideo',
+            '-pix_fmt', 'rgb24',    # Same pixels the png path would have written
+            '-s', f'{OUTPUT_WIDTH}x{OUTPUT_HEIGHT}',
+            '-framerate', str(fps),
+            '-i', '-',
+            '-i', self.video_path,
+        ] + self._encoder_output_args(fps)
     
     def _cleanup(self) -> None:
         """Remove temporary files and directory."""
+        if not os.path.exists(self.temp_dir):
+            return
         for file in os.listdir(self.temp_dir):
             os.remove(os.path.join(self.temp_dir, file))
         os.rmdir(self.temp_dir)
     
+    def cache_key(self) -> str:
+        """Artifact cache key of the output: the source, font and subtitles plus every setting that changes pixels."""
+        params = {
+            "subtitles": [(entry.text, entry.start_ms, entry.end_ms) for entry in self.subtitles.entries],
+            "font_size": self.font_size,
+            "render_mode": self.render_mode,
+            "compositor": self.compositor,
+            "background_stage": self.background_stage,
+            "intervals": self.intervals,
+            "prescale": self.prescale,
+            "static_frames": self.static_frames,
+            "blur_radius": self.blur_radius,
+            "brightness_factor": self.brightness_factor,
+            "explosion_factor": self.explosion_factor,
+            "zoom_factor": self.zoom_factor,
+        }
+        return artifact_cache.key("render", params, [self.video_path, self.font_path])
+
     def process_video(self) -> None:
         """
         Process the video by extracting frames, adding subtitles, and combining frames.
         """
-        if(os.path.exists(self.output_path)):
+        cache_key = self.cache_key()
+        if artifact_cache.fetch(cache_key, self.output_path):
             return self.output_path
-        try:
-            print("Processing ", self.output_path)
-            print("Extracting and processing frames...")
-            frame_count, fps = self._extract_frames()
-            
-            print("Combining frames into video...")
-            self._combine_frames(frame_count, fps)
+        with tracing.span("process_video", render_mode=self.render_mode, output=self.output_path):
+            try:
+                print("Processing ", self.output_path)
+                if self.render_mode == "pipe":
+                    print("Streaming frames into encoder...")
+                    frame_count, fps = self._stream_frames()
+                elif self.render_mode == "segments":
+                    print("Rendering segments in parallel...")
+                    frame_count, fps = self._render_segments()
+                elif self.render_mode == "filtergraph":
+                    print("Rendering with ffmpeg filtergraph...")
+                    frame_count, fps = self._render_filtergraph()
+                else:
+                    print("Extracting and processing frames...")
+                    with tracing.span("render_frames"):
+                        frame_count, fps = self._extract_frames()
+                
+                    print("Combining frames into video...")
+                    with tracing.span("encode"):
+                        self._combine_frames(frame_count, fps)
             
-            print("Cleaning up temporary files...")
-            self._cleanup()
+                print("Cleaning up temporary files...")
+                self._cleanup()
             
-            print(f"Video processing complete. Output saved to: {self.output_path}")
+                print(f"Video processing complete. Output saved to: {self.output_path}")
 
-            return self.output_path
+                return artifact_cache.store(cache_key, self.output_path)
         
-        except Exception as e:
-            print(f"Error processing video: {str(e)}")
-            self._cleanup()
-            raise
\ No newline at end of file
+            except Exception as e:
+                print(f"Error processing video: {str(e)}")
+                self._cleanup()
+                raise
+
+@dataclass
+class ShortSpec:
+    """One short cut from a shared source: (start_ms, end_ms) intervals on the source timeline, in order."""
+    output_path: str
+    subtitles: Subtitles
+    intervals: List[Tuple[int, int]]
+
+
+class MultiShortEditor:
+    """
+    Renders several shorts from the same source video in a single decode pass. The source is read once
+    in timeline order and every frame goes to each short whose intervals cover it. Shorts that show a
+    frame with the same captions share one render. Every short is encoded by its own ffmpeg process.
+    editor_options are passed to each short's VideoEditor, which always runs in pipe mode.
+    """
+    def __init__(self, video_root_folder: str, video_path: str, shorts: List[ShortSpec], **editor_options):
+        for short in shorts:
+            if any(previous[1] > current[0] for previous, current in zip(short.intervals, short.intervals[1:])):
+                raise ValueError(f"Intervals of {short.output_path} must be sorted and not overlap")
+
+        self.video_path = video_path
+        self.editors = [
+            VideoEditor(video_root_folder, video_path, short.output_path, short.subtitles, render_mode="pipe", intervals=short.intervals, **editor_options)
+            for short in shorts
+        ]
+
+    def _fan_out(self, cap, fps: float, editors: List[VideoEditor], targets: deque):
+        """
+        Yields one render task per distinct (source frame, captions) and records in targets which
+        shorts each task's result belongs to, in the order the results will come back.
+        """
+        ranges = [editor._source_frame_ranges(fps) for editor in editors]
+        cursors = [editor.subtitles.cursor() for editor in editors]
+        next_range = [0] * len(editors)
+        decode_ranges = merge_intervals([frame_range for short_ranges in ranges for frame_range in short_ranges])
+
+        task_number = 0
+        for position, frame in VideoEditor._decode_ranges(cap, fps, decode_ranges):
+            timestamp_ms = int((position / fps) * 1000)
+
+            # Captions on screen -> (cues, shorts showing them)
+            groups = {}
+            for idx, short_ranges in enumerate(ranges):
+                while next_range[idx] < len(short_ranges) and short_ranges[next_range[idx]][1] <= position:
+                    next_range[idx] += 1
+                if next_range[idx] == len(short_ranges) or short_ranges[next_range[idx]][0] > position:
+                    continue
+                cues = cursors[idx].at(timestamp_ms)
+                groups.setdefault(tuple(cue.text for cue in cues), (cues, []))[1].append(idx)
+
+            for cues, shorts in groups.values():
+                targets.append(shorts)
+                yield (task_number, timestamp_ms, frame, cues)
+                task_number += 1
+
+    def process_shorts(self) -> List[str]:
+        """Render every short that isn't cached yet. Returns all output paths."""
+        cache_keys = {editor.output_path: editor.cache_key() for editor in self.editors}
+        editors = [editor for editor in self.editors if not artifact_cache.fetch(cache_keys[editor.output_path], editor.output_path)]
+        if not editors:
+            return [editor.output_path for editor in self.editors]
+
+        with tracing.span("process_shorts", shorts=len(editors)):
+            # The first short drives decoding and the worker pool, they all share the same render settings
+            lead = editors[0]
+            cap = lead._open_capture()
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            lead._prewarm_captions([editor.subtitles for editor in editors])
+
+            print(f"Rendering {len(editors)} shorts from {self.video_path} in one pass...")
+            sinks = [subprocess.Popen(editor._pipe_encoder_cmd(fps), stdin=subprocess.PIPE) for editor in editors]
+            frames_written = [0] * len(editors)
+            targets = deque()
+
+            def write_result(result):
+                for idx in targets.popleft():
+                    sinks[idx].stdin.write(result)
+                    frames_written[idx] += 1
+
+            try:
+                renders = lead._dispatch_frames(cap, fps, None, write_result, self._fan_out(cap, fps, editors, targets))
+            finally:
+                cap.release()
+                for sink in sinks:
+                    sink.stdin.close()
+                return_codes = [sink.wait() for sink in sinks]
+
+            for sink, return_code in zip(sinks, return_codes):
+                if return_code != 0:
+                    raise subprocess.CalledProcessError(return_code, sink.args)
+
+            print(f"{renders} frames rendered for {sum(frames_written)} output frames")
+            for editor, written in zip(editors, frames_written):
+                print(f"  {editor.output_path}: {written} frames")
+                artifact_cache.store(cache_keys[editor.output_path], editor.output_path)
+
+        return [editor.output_path for editor in self.editors]
@@ -12,6 +12,9 @@ from pydub import AudioSegment
 
 from make_shorts import VideoEditor
 
+FONT_PATH = "fonts/Times-New-Roman/Times New Roman/times new roman.ttf"
+FRAMES_DIR = "news_shorts/temp_frames"
+
 
 def merge_audio_files(root_folder):
    audio_files = sorted([f for f in os.listdir(root_folder) if f.endswith('.mp3')])
@@ -44,7 +47,7 @@ def load_data(summary_path, timings_path):
     timings_df = pd.read_csv(timings_path)
     return summary, timings_df
 
-def create_frame(image_path, text, current_frame, total_frames, width=1080, height=1920):
+def create_frame(image_path, text, current_frame, total_frames, width=1080, height=1920, font_path=FONT_PATH):
     # Create base frame
     frame = Image.new('RGB', (width, height), color='black')
     
@@ -56,7 +59,7 @@ def create_frame(image_path, text, current_frame, total_frames, width=1080, heig
 
     # Add text at bottom
     draw = ImageDraw.Draw(frame)
-    font = ImageFont.truetype("fonts/Times-New-Roman/Times New Roman/times new roman.ttf", 64)
+    font = ImageFont.truetype(font_path, 64)
     
     # Calculate text position and wrap text
     margin = 40
@@ -86,22 +89,22 @@ def create_frame(image_path, text, current_frame, total_frames, width=1080, heig
     
     return frame
 
-def generate_segment_frames(content, start_time, end_time, fps=5, prev_count = 0):
+def generate_segment_frames(content, start_time, end_time, fps=5, prev_count = 0, font_path=FONT_PATH, frames_dir=FRAMES_DIR):
     duration = end_time - start_time
     num_frames = ceil(duration * fps / 1000)  # duration is in milliseconds
     # Save identical frames
     frames_paths = []
     for i in range(prev_count, num_frames+prev_count):
-        frame = create_frame(content['image'], content['text'], i-prev_count, num_frames)
+        frame = create_frame(content['image'], content['text'], i-prev_count, num_frames, font_path=font_path)
         # Create temporary directory for frames if it doesn't exist
-        os.makedirs('news_shorts/temp_frames', exist_ok=True)
-        frame_path = f'news_shorts/temp_frames/frame_{i:04d}.png'
+        os.makedirs(frames_dir, exist_ok=True)
+        frame_path = f'{frames_dir}/frame_{i:04d}.png'
         frame.save(frame_path, quality=95)
         frames_paths.append(frame_path)
     
     return frames_paths
 
-def create_video_segments(summary, timings_df, fps=5):
+def create_video_segments(summary, timings_df, fps=5, font_path=FONT_PATH, frames_dir=FRAMES_DIR):
     all_frame_paths = []
     prev_count = 0
     for i, (_, timing) in enumerate(timings_df.iterrows()):
@@ -111,14 +114,16 @@ def create_video_segments(summary, timings_df, fps=5):
             int(timing['start_time']),
             int(timing['end_time']),
             fps,
-            prev_count
+            prev_count,
+            font_path,
+            frames_dir
         )
         prev_count += len(frame_paths)
         all_frame_paths.extend(frame_paths)
     
     return all_frame_paths
 
-def create_final_video(frame_paths, audio_path, output_path, fps=5):
+def create_final_video(frame_paths, audio_path, output_path, fps=5, frames_dir=FRAMES_DIR):
     # # Create temporary file with frame paths
     # with open('news_shorts/temp_frames.txt', 'w') as f:
     #     for path in frame_paths:
@@ -127,14 +132,14 @@ def create_final_video(frame_paths, audio_path, output_path, fps=5):
     # print("Here?")
     # time.sleep(20)
     # Use ffmpeg to create video with audio
-    if not os.path.exists('news_shorts/temp_frames'):
+    if not os.path.exists(frames_dir):
         raise FileNotFoundError("Temporary frames directory not found")
     if not frame_paths:
         raise ValueError("No frames were generated")
     cmd = [
         'ffmpeg', '-y',
         '-framerate', str(fps),
-        '-i', 'news_shorts/temp_frames/frame_%04d.png',
+        '-i', f'{frames_dir}/frame_%04d.png',
         '-i', audio_path,
         '-c:v', 'libx264',
         '-preset', 'medium',
@@ -0,0 +1,111 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+# End of a stage's input, one is queued per worker
+_DONE = object()
+
+
+@dataclass
+class StageStats:
+    name: str
+    concurrency: int
+    items: int = 0
+    failures: int = 0
+    busy_seconds: float = 0.0
+    started: float = field(default_factory=time.perf_counter)
+    finished: Optional[float] = None
+
+    @property
+    def utilization(self) -> float:
+        """Share of the stage's worker slots that were busy since the pipeline started."""
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return self.busy_seconds / (self.concurrency * elapsed) if elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.name}: {self.items} done, {self.failures} failed, {self.utilization:.0%} busy ({self.concurrency} workers)"
+
+
+class Stage:
+    """
+    One step of a Pipeline. Runs work on up to concurrency items at a time and hands every result to
+    the next stage. The queue in front of a stage is bounded, so a slow stage holds back the ones
+    before it instead of piling up finished work. An item whose work raises is logged and dropped.
+    """
+    def __init__(self, name: str, work: Callable[[Any], Awaitable[Any]], concurrency: int = 1, queue_size: Optional[int] = None):
+        self.name = name
+        self.work = work
+        self.concurrency = concurrency
+        self.queue_size = queue_size or concurrency
+        self.inbox: Optional[asyncio.Queue] = None
+        self.stats = StageStats(name, concurrency)
+
+    async def _worker(self, next_stage: Optional["Stage"]):
+        while True:
+            item = await self.inbox.get()
+            if item is _DONE:
+                return
+
+            start = time.perf_counter()
+            try:
+                result = await self.work(item)
+            except Exception as e:
+                self.stats.failures += 1
+                print(f"{self.name}: error processing {item}: ", e)
+                continue
+            finally:
+                self.stats.busy_seconds += time.perf_counter() - start
+
+            self.stats.items += 1
+            if next_stage is not None:
+                await next_stage.inbox.put(result)
+
+    async def run(self, next_stage: Optional["Stage"]):
+        await asyncio.gather(*(self._worker(next_stage) for _ in range(self.concurrency)))
+        self.stats.finished = time.perf_counter()
+        if next_stage is not None:
+            for _ in range(next_stage.concurrency):
+                await next_stage.inbox.put(_DONE)
+
+
+class Pipeline:
+    """Stages connected by bounded asyncio queues, every item flows through them in order."""
+    def __init__(self, stages: list[Stage], log_interval: float = 30):
+        self.stages = stages
+        self.log_interval = log_interval
+
+    def log_utilization(self):
+        for stage in self.stages:
+            queued = stage.inbox.qsize() if stage.inbox is not None else 0
+            print(f"  {stage.stats}, {queued} queued")
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.log_interval)
+            print("Pipeline utilization:")
+            self.log_utilization()
+
+    async def _feed(self, items: Iterable[Any]):
+        first = self.stages[0]
+        for item in items:
+            await first.inbox.put(item)
+        for _ in range(first.concurrency):
+            await first.inbox.put(_DONE)
+
+    async def run(self, items: Iterable[Any]) -> list[StageStats]:
+        for stage in self.stages:
+            # Queues are created on the running loop
+            stage.inbox = asyncio.Queue(maxsize=stage.queue_size)
+            stage.stats = StageStats(stage.name, stage.concurrency)
+
+        monitor = asyncio.create_task(self._monitor())
+        try:
+            next_stages = self.stages[1:] + [None]
+            await asyncio.gather(self._feed(items), *(stage.run(next_stage) for stage, next_stage in zip(self.stages, next_stages)))
+        finally:
+            monitor.cancel()
+
+        print("Pipeline finished:")
+        self.log_utilization()
+        return [stage.stats for stage in self.stages]
@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+import cv2
+import numpy as np
+
+# Big enough that a mouth moving in a 4K frame still changes a few thumbnail pixels
+STATIC_THUMBNAIL_SIZE = (160, 90)
+
+
+@dataclass(frozen=True)
+class StaticFrameSkip:
+    """
+    Settings for reusing the previous rendered frame on a static camera.
+    threshold:         largest per pixel difference (0-255) between source thumbnails that still counts as
+                       the same picture. The max rather than the mean, so small local motion is never frozen.
+    refresh_interval:  render for real at least every this many frames
+    """
+    threshold: int = 12
+    refresh_interval: int = 30
+
+
+class StaticFrameDetector:
+    """
+    Decides, in timeline order, which frames can show the last rendered frame's output again: the thumbnail
+    is within threshold of that frame's and the same captions are on screen. Compared against the rendered
+    frame rather than the previous one, so slow pans can't creep through a frame at a time.
+    Run wherever the frames arrive in order, the parent for the worker pool or a worker within its
+    own segment. The caller keeps the last rendered output and repeats it.
+    """
+    def __init__(self, settings: StaticFrameSkip):
+        self.settings = settings
+        self.frames = 0
+        self.hits = 0
+        self._thumbnail = None
+        self._captions = None
+        self._repeats = 0
+
+    def is_repeat(self, frame: np.ndarray, captions: tuple[str, ...]) -> bool:
+        self.frames += 1
+        thumbnail = cv2.resize(frame, STATIC_THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+        repeat = (
+            self._thumbnail is not None
+            and captions == self._captions
+            and self._repeats < self.settings.refresh_interval
+            and cv2.absdiff(thumbnail, self._thumbnail).max() <= self.settings.threshold
+        )
+        if repeat:
+            self.hits += 1
+            self._repeats += 1
+        else:
+            # This frame gets rendered and becomes the new reference
+            self._thumbnail = thumbnail
+            self._captions = captions
+            self._repeats = 0
+        return repeat
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.frames if self.frames else 0.0
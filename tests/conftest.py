@@ -0,0 +1,45 @@
+import os
+import sys
+import cv2
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Every test renders from scratch
+os.environ["SHORTS_CACHE"] = "0"
+
+from benchmarks import FONT_PATH, make_synthetic_transcript, make_synthetic_video
+
+
+def decoded_frames(video_path: str) -> int:
+    """Frames a player actually gets out of the file, rather than the container's estimate."""
+    cap = cv2.VideoCapture(video_path)
+    count = 0
+    while cap.grab():
+        count += 1
+    cap.release()
+    return count
+
+def video_rate(video_path: str) -> float:
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return fps
+
+
+@pytest.fixture(scope="session")
+def font_path():
+    # SHORTS_TEST_FONT points at any .ttf when the repo font isn't checked out
+    for path in [os.environ.get("SHORTS_TEST_FONT"), os.path.join(ROOT, FONT_PATH)]:
+        if path and os.path.exists(path):
+            return path
+    pytest.skip("no caption font, set SHORTS_TEST_FONT")
+
+@pytest.fixture(scope="session")
+def source_video(tmp_path_factory):
+    """6 s, 30 fps, keyframe every 2 s."""
+    return make_synthetic_video(str(tmp_path_factory.mktemp("source") / "source.mp4"), 6, size="640x360")
+
+@pytest.fixture(scope="session")
+def subtitles_file(tmp_path_factory):
+    return make_synthetic_transcript(str(tmp_path_factory.mktemp("subtitles") / "subtitles.csv"), 6000)
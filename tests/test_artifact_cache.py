@@ -0,0 +1,74 @@
+import os
+import time
+from artifact_cache import ArtifactCache
+
+
+def _write(path, text):
+    with open(path, "w") as file:
+        file.write(text)
+
+def _read(path):
+    with open(path) as file:
+        return file.read()
+
+def _cache(tmp_path, **options):
+    cache = ArtifactCache(str(tmp_path / "cache"), **options)
+    cache.enabled = True
+    return cache
+
+def test_fetch_restores_stored_artifact(tmp_path):
+    cache = _cache(tmp_path)
+    output = str(tmp_path / "out.txt")
+    key = cache.key("test", {"n": 1})
+    assert not cache.fetch(key, output)
+    _write(output, "first")
+    cache.store(key, output)
+
+    os.remove(output)
+    assert cache.fetch(key, output)
+    assert _read(output) == "first"
+
+def test_write_through_link_is_not_served(tmp_path):
+    cache = _cache(tmp_path)
+    output = str(tmp_path / "out.txt")
+    key = cache.key("test", {"n": 1})
+    _write(output, "first")
+    cache.store(key, output)
+
+    # A producer reopening the working copy in place, then the output is asked for again
+    time.sleep(0.01)
+    _write(output, "rewritten!")
+    os.remove(output)
+    assert not cache.fetch(key, output)
+
+def test_disabled_fetch_breaks_the_link(tmp_path):
+    cache = _cache(tmp_path)
+    output = str(tmp_path / "out.txt")
+    key = cache.key("test", {"n": 1})
+    _write(output, "first")
+    cache.store(key, output)
+
+    cache.enabled = False
+    assert not cache.fetch(key, output)
+    _write(output, "rebuilt without the cache")
+
+    cache.enabled = True
+    os.remove(output)
+    assert cache.fetch(key, output)
+    assert _read(output) == "first"
+
+def test_eviction_keeps_outputs(tmp_path):
+    cache = _cache(tmp_path, max_bytes=10)
+    deliverable = str(tmp_path / "final_video_subbed.mp4")
+    download = str(tmp_path / "source_video.mp4")
+    _write(deliverable, "rendered short")
+    cache.store(cache.key("render"), deliverable)
+    _write(download, "downloaded source")
+    cache.store(cache.key("video"), download, regenerable=True)
+    _write(str(tmp_path / "late.csv"), "x" * 20)
+    cache.store(cache.key("late"), str(tmp_path / "late.csv"))
+
+    # Everything but the newest artifact is over the limit and evicted
+    assert _read(deliverable) == "rendered short"
+    assert not os.path.exists(download)
+    assert not cache.fetch(cache.key("render"), str(tmp_path / "copy.mp4"))
@@ -0,0 +1,40 @@
+import cv2
+import numpy as np
+from clip_new import FILTER_CUT_MIN_INTERVALS, clip_mode, clip_video
+
+# 30 fps source: frames 61-116 are shown in [2033, 3900), frames 135-164 in [4500, 5500)
+INTERVALS = [(2033, 3900), (4500, 5500)]
+EXPECTED_FRAMES = list(range(61, 117)) + list(range(135, 165))
+
+
+def _frames(video_path: str) -> list[np.ndarray]:
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame.astype(np.int16))
+    cap.release()
+    return frames
+
+def _assert_source_frames(clip_frames, source_frames):
+    assert len(clip_frames) == len(EXPECTED_FRAMES)
+    for clip_frame, source_idx in zip(clip_frames, EXPECTED_FRAMES):
+        # Re-encoded, so the closest source frame rather than an exact match
+        distances = {idx: np.abs(clip_frame - source_frames[idx]).mean() for idx in (source_idx - 1, source_idx, source_idx + 1)}
+        assert min(distances, key=distances.get) == source_idx
+
+def test_frame_accurate_modes_cut_the_same_frames(tmp_path, source_video):
+    source_frames = _frames(source_video)
+    for mode in ["smart", "filter"]:
+        output_path = str(tmp_path / f"{mode}.mp4")
+        clip_video(source_video, INTERVALS, output_path, mode=mode)
+        _assert_source_frames(_frames(output_path), source_frames)
+
+def test_clip_mode():
+    many = FILTER_CUT_MIN_INTERVALS + 1
+    assert clip_mode("smart", many) == "filter"
+    assert clip_mode("smart", many, auto_filter=False) == "smart"
+    assert clip_mode("smart", FILTER_CUT_MIN_INTERVALS) == "smart"
+    assert clip_mode("copy", many) == "copy"
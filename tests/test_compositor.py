@@ -0,0 +1,69 @@
+import cv2
+import ffmpeg
+import numpy as np
+import pytest
+from PIL import Image
+
+import make_shorts
+from compositor import OUTPUT_WIDTH, BackgroundStage, Cv2Compositor
+from make_shorts import Subtitles, VideoEditor
+
+
+@pytest.fixture(scope="module")
+def cut_video(tmp_path_factory):
+    """4 s of flat grey brightening slowly, with a cut to a much brighter shot at 2 s."""
+    output_file = str(tmp_path_factory.mktemp("cut") / "cut.mp4")
+    video = ffmpeg.input("color=c=gray:size=640x360:rate=30:duration=4", f="lavfi").filter("geq", lum="60+4*T+if(gte(T,2),80,0)", cb=128, cr=128)
+    audio = ffmpeg.input("anullsrc=duration=4", f="lavfi")
+    stream = ffmpeg.output(video, audio, output_file, vcodec="libx264", preset="veryfast", g=60, pix_fmt="yuv420p", acodec="aac", shortest=None)
+    ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
+    return output_file
+
+def background_brightness(video_path: str) -> np.ndarray:
+    cap = cv2.VideoCapture(video_path)
+    brightness = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        # Blurred background above the foreground
+        brightness.append(frame[100:500].mean())
+    cap.release()
+    return np.array(brightness)
+
+def test_background_reuse_follows_the_timeline(tmp_path, monkeypatch, cut_video, subtitles_file, font_path):
+    # Three workers, so consecutive chunks land on different processes
+    monkeypatch.setattr(make_shorts.mp, "cpu_count", lambda: 4)
+    output_path = str(tmp_path / "cut.mp4")
+    VideoEditor(str(tmp_path), cut_video, output_path, Subtitles(subtitles_file), font_path=font_path,
+                render_mode="pipe", compositor="cv2", background_stage=BackgroundStage()).process_video()
+
+    brightness = background_brightness(output_path)
+    assert len(brightness) == 120
+    # The background switches on the first frame after the cut, not some frames later
+    assert brightness[60] - brightness[59] > 20
+    # A reused background may lag the shot, never go back to an older frame's
+    for shot in [brightness[:60], brightness[60:]]:
+        assert all(current >= previous - 0.2 for previous, current in zip(shot, shot[1:]))
+
+@pytest.mark.parametrize("pattern", ["stripes", "checkerboard", "noise"])
+def test_downscaled_foreground_matches_pil(pattern):
+    # A 4K frame is shrunk for the zoomed foreground, fine detail is where an unfiltered resize aliases
+    height, width = 2160, 3840
+    if pattern == "stripes":
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        frame[:, ::2] = 255
+    elif pattern == "checkerboard":
+        frame = (np.indices((height, width)).sum(axis=0) % 2 * 255).astype(np.uint8)[..., None].repeat(3, axis=2)
+    else:
+        frame = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+    compositor = Cv2Compositor(blur_radius=30, brightness_factor=0.4, explosion_factor=2, zoom_factor=1.9)
+    output = compositor.composite(frame)
+    assert compositor.fg_size[0] < width
+
+    # The foreground of VideoEditor.render_frame, resized by PIL
+    pil_foreground = np.asarray(Image.fromarray(frame).resize(compositor.fg_size, Image.LANCZOS))
+    pil_foreground = pil_foreground[:, compositor.fg_crop_x:compositor.fg_crop_x + OUTPUT_WIDTH]
+    foreground = output[compositor.paste_y:compositor.paste_y + compositor.fg_height]
+    assert np.abs(foreground.astype(int) - pil_foreground).mean() < 12
@@ -0,0 +1,181 @@
+import asyncio
+import os
+import threading
+import time
+import shutil
+import pytest
+from conftest import decoded_frames
+from yt_utils import ProgressStream, VideoTools
+
+URL = "https://www.youtube.com/watch?v=test"
+UPDATES = [{"status": "downloading", "downloaded_bytes": n, "total_bytes": 3} for n in range(3)] + [{"status": "finished"}]
+
+
+class FakeDownloader:
+    """
+    Stands in for YoutubeDL: reports progress through the hooks and writes outtmpl, or stalls until a hook cancels it.
+    With section set, it copies that file as the first section after delay seconds without any progress updates,
+    like ffmpeg fetching a range.
+    """
+    stall = False
+    section = None
+    delay = 0
+    stopped = threading.Event()
+
+    def __init__(self, opts):
+        self.opts = opts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def _report(self, d):
+        for hook in self.opts["progress_hooks"]:
+            hook(d)
+
+    def download(self, urls):
+        try:
+            if self.section is not None:
+                time.sleep(self.delay)
+                shutil.copy(self.section, self.opts["outtmpl"] % {"section_start": 0, "ext": "mp4"})
+                return
+            if self.stall:
+                while True:
+                    self._report(UPDATES[0])
+                    time.sleep(0.02)
+            for d in UPDATES:
+                self._report(d)
+            with open(self.opts["outtmpl"], "w") as file:
+                file.write("video")
+        finally:
+            type(self).stopped.set()
+
+
+@pytest.fixture
+def downloader(monkeypatch):
+    FakeDownloader.stall = False
+    FakeDownloader.section = None
+    FakeDownloader.delay = 0
+    FakeDownloader.stopped = threading.Event()
+    monkeypatch.setattr(VideoTools, "downloader", FakeDownloader)
+    return FakeDownloader
+
+async def _wait_stopped(downloader):
+    # The thread ends at its next progress update, its temp files go once it has
+    await asyncio.to_thread(downloader.stopped.wait, 5)
+    await asyncio.sleep(0.05)
+
+def _leftovers(directory):
+    return [name for name in os.listdir(directory) if name.startswith(("video_", "sections_"))]
+
+def test_progress(tmp_path, downloader):
+    async def run():
+        progress = ProgressStream()
+        received = []
+
+        async def collect():
+            async for d in progress:
+                received.append(d)
+
+        path, _ = await asyncio.gather(VideoTools.download_yt_video(URL, str(tmp_path), progress=progress), collect())
+        return path, received
+
+    path, received = asyncio.run(run())
+    assert path == str(tmp_path / "source_video.mp4")
+    assert open(path).read() == "video"
+    assert received == UPDATES
+    assert _leftovers(tmp_path) == []
+
+def test_timeout_stops_the_download(tmp_path, downloader):
+    downloader.stall = True
+
+    async def run():
+        result = await VideoTools.download_yt_video(URL, str(tmp_path), timeout=0.2)
+        await _wait_stopped(downloader)
+        return result
+
+    assert asyncio.run(run()) is None
+    assert downloader.stopped.is_set()
+    assert not os.path.exists(tmp_path / "source_video.mp4")
+    assert _leftovers(tmp_path) == []
+
+def test_cancel_stops_the_download(tmp_path, downloader):
+    downloader.stall = True
+
+    async def run():
+        task = asyncio.create_task(VideoTools.download_yt_video(URL, str(tmp_path)))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await _wait_stopped(downloader)
+
+    asyncio.run(run())
+    assert downloader.stopped.is_set()
+    assert not os.path.exists(tmp_path / "source_video.mp4")
+    assert _leftovers(tmp_path) == []
+
+def test_sections(tmp_path, downloader, source_video):
+    downloader.section = source_video
+    # Padded to the whole 6 s source, which is then one section
+    path, time_map = asyncio.run(VideoTools.download_yt_sections(URL, str(tmp_path), [(1000, 2000)]))
+    assert path == str(tmp_path / "source_sections.mp4")
+    assert time_map.map_span(1000, 2000) == (1000, 2000)
+    assert decoded_frames(path) == 180
+    assert _leftovers(tmp_path) == []
+
+def test_sections_timeout_during_cut(tmp_path, downloader, source_video):
+    # Times out while the section is cut, which reports no progress
+    downloader.section = source_video
+
+    async def run():
+        result = await VideoTools.download_yt_sections(URL, str(tmp_path), [(1000, 2000)], timeout=0.3)
+        await _wait_stopped(downloader)
+        # Long enough for the cut and merge to finish, had the worker kept going
+        await asyncio.sleep(3)
+        return result
+
+    assert asyncio.run(run()) is None
+    assert not os.path.exists(tmp_path / "source_sections.mp4")
+    assert _leftovers(tmp_path) == []
+
+def test_failed_download_ends_the_progress_printer(tmp_path, monkeypatch):
+    pytest.importorskip("google.generativeai")
+    import main
+
+    async def failing_download(url, video_dir, intervals, reduced_subtitles_path, progress=None):
+        progress.hook(UPDATES[0])
+        raise RuntimeError("network down")
+
+    monkeypatch.setattr(main, "download_intervals", failing_download)
+
+    async def run():
+        job = main.Job(URL, str(tmp_path), intervals=[(0, 1000)], reduced_subtitles_path=str(tmp_path / "subtitles.csv"))
+        with pytest.raises(RuntimeError, match="network down"):
+            await main.download(job)
+        return asyncio.all_tasks() - {asyncio.current_task()}
+
+    assert asyncio.run(run()) == set()
+
+def test_malformed_url_is_skipped(monkeypatch):
+    pytest.importorskip("google.generativeai")
+    import main
+
+    transcribed = []
+
+    async def transcribe(job):
+        transcribed.append(job.url)
+        return job
+
+    async def passthrough(job, **kwargs):
+        return job
+
+    monkeypatch.setattr(main, "transcribe", transcribe)
+    for stage in ["select", "download", "render"]:
+        monkeypatch.setattr(main, stage, passthrough)
+
+    stats = asyncio.run(main.perform_work(["https://www.youtube.com/watch?list=no-video-id", URL]))
+    assert transcribed == [URL]
+    assert stats[-1].items == 1
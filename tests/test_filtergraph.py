@@ -0,0 +1,28 @@
+import cv2
+from conftest import decoded_frames, video_rate
+from make_shorts import Subtitles, VideoEditor
+
+INTERVALS = [(1000, 2000), (3000, 4000)]
+
+
+def _render(tmp_path, source_video, subtitles_file, font_path, render_mode, intervals=None):
+    output_path = str(tmp_path / f"{render_mode}.mp4")
+    VideoEditor(str(tmp_path), source_video, output_path, Subtitles(subtitles_file), font_path=font_path,
+                render_mode=render_mode, intervals=intervals).process_video()
+    return output_path
+
+def test_intervals_keep_frame_count_and_rate(tmp_path, source_video, subtitles_file, font_path):
+    filtergraph = _render(tmp_path, source_video, subtitles_file, font_path, "filtergraph", INTERVALS)
+    pipe = _render(tmp_path, source_video, subtitles_file, font_path, "pipe", INTERVALS)
+
+    # Two 1 s ranges of a 30 fps source
+    assert decoded_frames(filtergraph) == decoded_frames(pipe) == 60
+    assert video_rate(filtergraph) == video_rate(pipe) == 30
+
+def test_square_pixels(tmp_path, source_video, subtitles_file, font_path):
+    for intervals in [None, INTERVALS]:
+        cap = cv2.VideoCapture(_render(tmp_path, source_video, subtitles_file, font_path, "filtergraph", intervals))
+        assert (cap.get(cv2.CAP_PROP_FRAME_WIDTH), cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) == (1080, 1920)
+        # 0 when the stream doesn't set one, which also means square
+        assert cap.get(cv2.CAP_PROP_SAR_NUM) in (0, 1) and cap.get(cv2.CAP_PROP_SAR_DEN) == 1
+        cap.release()
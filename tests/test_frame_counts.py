@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+from make_shorts import Subtitles, VideoEditor
+from utils import count_frames, get_keyframe_index
+
+
+def frames_at(video_path: str, indices: set[int]) -> dict[int, np.ndarray]:
+    cap = cv2.VideoCapture(video_path)
+    frames = {}
+    index = 0
+    while len(frames) < len(indices) and cap.grab():
+        if index in indices:
+            frames[index] = cap.retrieve()[1].astype(int)
+        index += 1
+    cap.release()
+    return frames
+
+
+def test_keyframe_index(source_video):
+    keyframes, frame_count = get_keyframe_index(source_video)
+    # 6 s at 30 fps with a keyframe every 2 s
+    assert frame_count == 180
+    assert keyframes == [0, 60, 120]
+
+def test_segments_render_every_frame_once(tmp_path, source_video, subtitles_file, font_path):
+    output_path = str(tmp_path / "segments.mp4")
+    editor = VideoEditor(str(tmp_path), source_video, output_path, Subtitles(subtitles_file), font_path=font_path,
+                         render_mode="segments", num_segments=3)
+    editor.process_video()
+    assert count_frames(output_path) == 180
+
+    # The frames either side of every seam show the same picture as one sequential render
+    pipe_path = str(tmp_path / "pipe.mp4")
+    VideoEditor(str(tmp_path), source_video, pipe_path, Subtitles(subtitles_file), font_path=font_path,
+                render_mode="pipe").process_video()
+    segments, _ = editor._plan_segments(3)
+    assert len(segments) == 3
+    seams = {frame for start, _ in segments[1:] for frame in (start - 1, start)}
+    pipe_frames = frames_at(pipe_path, seams | {frame + 1 for frame in seams})
+    segment_frames = frames_at(output_path, seams)
+    for frame in sorted(seams):
+        difference = np.abs(segment_frames[frame] - pipe_frames[frame]).mean()
+        # Only encoding noise, and far closer than the next frame, so nothing shifted at the seam
+        assert difference < 1.5
+        assert difference < np.abs(segment_frames[frame] - pipe_frames[frame + 1]).mean() / 2
+
+def test_short_interval(tmp_path, source_video, subtitles_file, font_path):
+    for render_mode in ["png", "pipe"]:
+        output_path = str(tmp_path / f"{render_mode}.mp4")
+        VideoEditor(str(tmp_path), source_video, output_path, Subtitles(subtitles_file), font_path=font_path,
+                    render_mode=render_mode, intervals=[(1000, 1500)]).process_video()
+        # Frames 30 to 44, shown at 1000 ms up to 1466 ms
+        assert count_frames(output_path) == 15
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+import time
+import pytest
+
+pytest.importorskip("google.generativeai")
+import job_queue
+from job_queue import JobQueue
+
+HOST = "host"
+
+
+def _dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+def _queue(tmp_path, count=1):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    queue.enqueue([f"https://www.youtube.com/watch?v={idx}" for idx in range(count)], str(tmp_path))
+    return queue
+
+def test_claims_of_stopped_workers_are_released(tmp_path):
+    queue = _queue(tmp_path, 3)
+    dead = queue.claim(f"{HOST}:{_dead_pid()}")
+    alive = queue.claim(f"{HOST}:{os.getppid()}")
+    other_host = queue.claim(f"elsewhere:{_dead_pid()}")
+
+    assert queue.release_dead_claims(f"{HOST}:{os.getpid()}") == 1
+    assert queue.get(dead["id"])["status"] == "pending"
+    assert queue.get(dead["id"])["attempts"] == 0
+    # Alive, or on a host whose processes can't be checked from here
+    assert queue.get(alive["id"])["status"] == "running"
+    assert queue.get(other_host["id"])["status"] == "running"
+
+def test_heartbeat_keeps_long_jobs_claimed(tmp_path, monkeypatch):
+    queue = _queue(tmp_path)
+    job = queue.claim(f"{HOST}:1")
+
+    # Long past the stale window, but the worker is still renewing its claim
+    monkeypatch.setattr(job_queue, "STALE_CLAIM_SECONDS", 0.05)
+    for _ in range(3):
+        time.sleep(0.02)
+        queue.heartbeat(f"{HOST}:1")
+        assert queue.claim(f"{HOST}:2") is None
+
+    time.sleep(0.1)
+    assert queue.claim(f"{HOST}:2")["id"] == job["id"]
@@ -0,0 +1,46 @@
+import cv2
+import ffmpeg
+import pytest
+
+import make_shorts
+from make_shorts import Subtitles, VideoEditor
+from static_frames import StaticFrameSkip
+
+
+@pytest.fixture(scope="module")
+def ramp_video(tmp_path_factory):
+    """4 s of flat grey brightening by about one level per frame, so each frame looks static next to the last few."""
+    output_file = str(tmp_path_factory.mktemp("ramp") / "ramp.mp4")
+    video = ffmpeg.input("color=c=gray:size=640x360:rate=30:duration=4", f="lavfi").filter("geq", lum="40+30*T", cb=128, cr=128)
+    audio = ffmpeg.input("anullsrc=duration=4", f="lavfi")
+    stream = ffmpeg.output(video, audio, output_file, vcodec="libx264", preset="veryfast", g=60, pix_fmt="yuv420p", acodec="aac", shortest=None)
+    ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
+    return output_file
+
+def foreground_brightness(video_path: str) -> list[float]:
+    cap = cv2.VideoCapture(video_path)
+    brightness = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        # Middle of the foreground, clear of the captions below it
+        brightness.append(frame[800:900, 200:880].mean())
+    cap.release()
+    return brightness
+
+@pytest.mark.parametrize("render_mode, transport", [("pipe", "pickle"), ("pipe", "shm"), ("png", "pickle")])
+def test_static_frames_follow_a_slow_change(tmp_path, monkeypatch, ramp_video, subtitles_file, font_path, render_mode, transport):
+    # Three workers, so consecutive chunks land on different processes
+    monkeypatch.setattr(make_shorts.mp, "cpu_count", lambda: 4)
+    output_path = str(tmp_path / "ramp.mp4")
+    editor = VideoEditor(str(tmp_path), ramp_video, output_path, Subtitles(subtitles_file), font_path=font_path,
+                         render_mode=render_mode, compositor="cv2", transport=transport, static_frames=StaticFrameSkip())
+    editor.process_video()
+
+    brightness = foreground_brightness(output_path)
+    assert len(brightness) == 120
+    assert editor.static_frame_hits > 0
+    # A repeated frame may hold the picture back, never send it back to an older one
+    assert all(current >= previous - 0.5 for previous, current in zip(brightness, brightness[1:]))
+    assert brightness[-1] - brightness[0] > 80
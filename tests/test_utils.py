@@ -0,0 +1,37 @@
+from utils import TimeMap, merge_intervals
+
+
+def test_merge_bridges_gaps_up_to_the_tolerance():
+    intervals = [(0, 1000), (1300, 2000), (2301, 3000)]
+    assert merge_intervals(intervals) == intervals
+    assert merge_intervals(intervals, gap_tolerance=300) == [(0, 2000), (2301, 3000)]
+    assert merge_intervals(intervals, gap_tolerance=301) == [(0, 3000)]
+    # Unsorted and overlapping input
+    assert merge_intervals([(1300, 2000), (0, 1500), (100, 200)]) == [(0, 2000)]
+
+def test_short_intervals_are_widened_to_min_length():
+    # Padded around the middle, long ones are kept as they are
+    assert merge_intervals([(1000, 1200), (5000, 6000)], min_length=500) == [(850, 1350), (5000, 6000)]
+    # Not before the start of the video
+    assert merge_intervals([(100, 200)], min_length=500) == [(0, 500)]
+    # Widening into a neighbour merges them
+    assert merge_intervals([(1000, 1100), (1200, 2200)], min_length=500) == [(800, 2200)]
+    assert merge_intervals([(1000, 1100), (1500, 2500)], gap_tolerance=200, min_length=500) == [(800, 2500)]
+
+def test_time_map_spans_at_section_edges():
+    time_map = TimeMap([(1000, 2000), (3000, 4000)])
+    assert time_map.duration == 2000
+
+    # Exactly a kept section
+    assert time_map.map_span(1000, 2000) == (0, 1000)
+    assert time_map.map_span(3000, 4000) == (1000, 2000)
+    # Hanging over the start or the end of the kept sections
+    assert time_map.map_span(500, 1500) == (0, 500)
+    assert time_map.map_span(3500, 4500) == (1500, 2000)
+    # Across the cut, shorter by the cut
+    assert time_map.map_span(1500, 3500) == (500, 1500)
+    assert time_map.map_span(0, 5000) == (0, 2000)
+    # Entirely cut
+    assert time_map.map_span(2200, 2800) is None
+    assert time_map.map_span(4500, 5000) is None
+    assert time_map.map_span(0, 500) is None
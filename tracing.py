@@ -0,0 +1,273 @@
+import bisect
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from typing import Optional
+import psutil
+
+# Set to 1 to trace. Worker processes inherit it, forked or spawned.
+TRACE_ENV = "SHORTS_TRACE"
+# Upper bounds of the per frame histogram buckets, in ms
+HISTOGRAM_BOUNDS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, math.inf]
+RSS_SAMPLE_SECONDS = 0.1
+
+enabled = os.getenv(TRACE_ENV) == "1"
+
+def enable(on: bool = True) -> None:
+    global enabled
+    enabled = on
+    os.environ[TRACE_ENV] = "1" if on else "0"
+
+
+def process_tree_rss() -> int:
+    """Resident memory of this process and its workers, in bytes."""
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return rss
+
+def _cpu_seconds() -> float:
+    # Children only count once they have been waited for, so pools and ffmpeg show up when they exit
+    times = psutil.Process().cpu_times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class Histogram:
+    """Fixed bucket latency histogram, cheap to fill per frame and to merge across worker processes."""
+    def __init__(self):
+        self.counts = [0] * len(HISTOGRAM_BOUNDS_MS)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, ms)] += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def merge(self, other: "Histogram") -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the percentile, capped at the largest value seen."""
+        target = fraction * sum(self.counts)
+        seen = 0
+        for bound, count in zip(HISTOGRAM_BOUNDS_MS, self.counts):
+            seen += count
+            if seen >= target and count:
+                return round(min(bound, self.max_ms), 3)
+        return round(self.max_ms, 3)
+
+    def to_dict(self) -> dict:
+        count = sum(self.counts)
+        return {
+            "count": count,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / count, 3) if count else 0,
+            "p50_ms": self.percentile(0.5),
+            "p90_ms": self.percentile(0.9),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": {f"<={bound}": count for bound, count in zip(HISTOGRAM_BOUNDS_MS, self.counts) if count},
+        }
+
+
+# Per frame timings of this process since the last drain
+_histograms: dict[str, Histogram] = {}
+
+def now() -> Optional[float]:
+    """Start of a per frame timing, None when tracing is off so observe returns straight away."""
+    return time.perf_counter() if enabled else None
+
+def observe(name: str, start: Optional[float]) -> None:
+    if start is None:
+        return
+    histogram = _histograms.get(name)
+    if histogram is None:
+        histogram = _histograms[name] = Histogram()
+    histogram.add((time.perf_counter() - start) * 1000)
+
+def drain_histograms() -> Optional[dict[str, Histogram]]:
+    """Takes this process's timings, so a worker can send them back with its results."""
+    global _histograms
+    if not _histograms:
+        return None
+    drained, _histograms = _histograms, {}
+    return drained
+
+def merge_histograms(histograms: Optional[dict[str, Histogram]]) -> None:
+    for name, histogram in (histograms or {}).items():
+        _histograms.setdefault(name, Histogram()).merge(histogram)
+
+
+class Span:
+    def __init__(self, tracer: "Tracer", name: str, attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.children: list = []
+        self.histograms: dict[str, Histogram] = {}
+        self.peak_rss_bytes = 0
+        self.duration = None
+        self._token = None
+
+    def begin(self) -> None:
+        self.start = time.time()
+        self._perf_start = time.perf_counter()
+        self._cpu_start = _cpu_seconds()
+        self.peak_rss_bytes = process_tree_rss()
+        _sampler.add(self)
+
+    def finish(self, exc: Optional[BaseException] = None) -> None:
+        _sampler.remove(self)
+        self.duration = time.perf_counter() - self._perf_start
+        self.cpu_seconds = _cpu_seconds() - self._cpu_start
+        self.peak_rss_bytes = max(self.peak_rss_bytes, process_tree_rss())
+        if exc is not None:
+            self.attrs["error"] = f"{type(exc).__name__}: {exc}"
+        # Frame timings observed while this was the innermost span
+        for name, histogram in (drain_histograms() or {}).items():
+            self.histograms.setdefault(name, Histogram()).merge(histogram)
+
+    def __enter__(self) -> "Span":
+        self.begin()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _current_span.reset(self._token)
+        self.finish(exc)
+
+    def to_dict(self) -> dict:
+        # A span still open, like the root of a job that is still running, reports what it has so far
+        is_open = self.duration is None
+        duration = time.perf_counter() - self._perf_start if is_open else self.duration
+        cpu_seconds = _cpu_seconds() - self._cpu_start if is_open else self.cpu_seconds
+        return {
+            "name": self.name,
+            **({"attrs": self.attrs} if self.attrs else {}),
+            **({"open": True} if is_open else {}),
+            "start": self.start,
+            "seconds": round(duration, 4),
+            "cpu_seconds": round(cpu_seconds, 3),
+            "peak_rss_mb": round(self.peak_rss_bytes / 1024 / 1024, 1),
+            **({"frames": {name: histogram.to_dict() for name, histogram in self.histograms.items()}} if self.histograms else {}),
+            "children": [child if isinstance(child, dict) else child.to_dict() for child in self.children],
+        }
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+_NULL_SPAN = _NullSpan()
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class _RssSampler:
+    """Background thread raising the peak RSS of every open span, so peaks between span edges are seen."""
+    def __init__(self):
+        self.spans: set[Span] = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, span: Span) -> None:
+        with self.lock:
+            self.spans.add(span)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def remove(self, span: Span) -> None:
+        with self.lock:
+            self.spans.discard(span)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(RSS_SAMPLE_SECONDS)
+            with self.lock:
+                if not self.spans:
+                    self.thread = None
+                    return
+                spans = list(self.spans)
+            rss = process_tree_rss()
+            for span in spans:
+                span.peak_rss_bytes = max(span.peak_rss_bytes, rss)
+
+_sampler = _RssSampler()
+
+
+class Tracer:
+    """
+    Spans of one job, written as a JSON report. The root span runs from creation until the tracer
+    is closed. Inside "with tracer:", or a span opened from tracer.span, any tracing.span nests
+    under it. A job that moves between asyncio tasks opens its spans with tracer.span in each.
+    Does nothing when tracing is off.
+    """
+    def __init__(self, name: str, **attrs):
+        self.root = None
+        if enabled:
+            self.root = Span(self, name, attrs)
+            self.root.begin()
+        self._token = None
+
+    def __enter__(self) -> "Tracer":
+        if self.root is not None:
+            self._token = _current_span.set(self.root)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.root is not None:
+            _current_span.reset(self._token)
+            self.close(exc)
+
+    def close(self, exc: Optional[BaseException] = None) -> None:
+        if self.root is not None and self.root.duration is None:
+            self.root.finish(exc)
+
+    def span(self, name: str, **attrs):
+        """A span under this job's innermost open span, for code that runs outside the job's context."""
+        if self.root is None:
+            return _NULL_SPAN
+        parent = _current_span.get()
+        if parent is None or parent.tracer is not self:
+            parent = self.root
+        child = Span(self, name, attrs)
+        parent.children.append(child)
+        return child
+
+    def to_dict(self) -> Optional[dict]:
+        return self.root.to_dict() if self.root is not None else None
+
+    def write_report(self, path: str) -> Optional[str]:
+        if self.root is None:
+            return None
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=1)
+        print(f"Trace report saved to: {path}")
+        return path
+
+
+def span(name: str, **attrs):
+    """A span under the current one. Outside a Tracer, or with tracing off, it does nothing."""
+    parent = _current_span.get()
+    if parent is None:
+        return _NULL_SPAN
+    return parent.tracer.span(name, **attrs)
+
+def attach(report: Optional[dict]) -> None:
+    """Adds the report of a Tracer that ran in another process under the current span."""
+    parent = _current_span.get()
+    if parent is not None and report is not None:
+        parent.children.append(report)
@@ -1,20 +1,84 @@
+import bisect
+import os
+import subprocess
+from typing import Optional
 import cv2
 
-# Combine overlapping or adjacent intervals
-def merge_intervals(intervals):
+# Caption cues are usually 50-300 ms apart, bridging that keeps a sentence in one segment
+CAPTION_GAP_TOLERANCE_MS = 300
+# Shorter segments are a flash on screen that looks like a cut artifact, they are widened to this
+MIN_SEGMENT_MS = 500
+
+# Combine overlapping or adjacent intervals, and ones at most gap_tolerance apart.
+# Merged intervals shorter than min_length are widened to min_length around their middle
+# (not before 0), merging again with any neighbour they then reach.
+def merge_intervals(intervals, gap_tolerance=0, min_length=0):
     if not intervals:
         return []
     
-    intervals.sort(key=lambda x: (x[0], x[1]))
+    intervals = sorted(intervals, key=lambda x: (x[0], x[1]))
     merged = [intervals[0]]
 
     for current in intervals[1:]:
         last = merged[-1]
-        if current[0] <= last[1]:
+        if current[0] <= last[1] + gap_tolerance:
             merged[-1] = (last[0], max(last[1], current[1]))
         else:
             merged.append(current)
-    return merged
+
+    if not min_length:
+        return merged
+
+    padded = []
+    for start, end in merged:
+        if end - start < min_length:
+            start = max(0, (start + end) // 2 - min_length // 2)
+            end = start + min_length
+        if padded and start <= padded[-1][1] + gap_tolerance:
+            padded[-1] = (padded[-1][0], max(padded[-1][1], end))
+        else:
+            padded.append((start, end))
+    return padded
+
+
+class TimeMap:
+    """
+    Maps source timestamps onto the output of a clip that plays the kept (start, end) source
+    intervals back to back, in the same units as the intervals.
+    """
+    def __init__(self, intervals):
+        self.intervals = intervals
+        self.starts = [start for start, _ in intervals]
+        # Output time at which each interval begins
+        self.offsets = []
+        offset = 0
+        for start, end in intervals:
+            self.offsets.append(offset)
+            offset += end - start
+        self.duration = offset
+
+    def to_output(self, source_time) -> Optional[float]:
+        """Output time of a source timestamp, None if it falls in a part that was cut."""
+        idx = bisect.bisect_right(self.starts, source_time) - 1
+        if idx < 0 or source_time > self.intervals[idx][1]:
+            return None
+        return self.offsets[idx] + source_time - self.starts[idx]
+
+    def map_span(self, start, end) -> Optional[tuple]:
+        """
+        Output (start, end) of a source span, clipped to the kept intervals it overlaps. A span running
+        across a cut ends up shorter by the cut. None if nothing of it is kept.
+        """
+        first = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        if first < len(self.intervals) and self.intervals[first][1] < start:
+            first += 1
+        last = bisect.bisect_right(self.starts, end) - 1
+        if first >= len(self.intervals) or last < first:
+            return None
+
+        output_start = self.to_output(max(start, self.intervals[first][0]))
+        output_end = self.to_output(min(end, self.intervals[last][1]))
+        return output_start, output_end
 
 def count_frames(video_path):
     cap = cv2.VideoCapture(video_path)
@@ -26,4 +90,56 @@ def count_frames(video_path):
     print(f"Estimated frames: {estimated_frames}")
     print(f"FPS: {fps}")
     print(f"Duration: {duration:.2f} seconds")
-    
\ No newline at end of file
+
+    return estimated_frames
+
+# Frame indexes by (path, mtime), so every cut of the same source probes it once
+_frame_indexes: dict[tuple[str, float], tuple[list[float], list[int]]] = {}
+
+def get_frame_index(video_path) -> tuple[list[float], list[int]]:
+    """
+    Presentation time of every video frame in display order, in seconds from the start of the file
+    (what ffmpeg's -ss counts from), plus the display order indices of the keyframes.
+    Read from packet flags with ffprobe, so nothing gets decoded, and cached per source.
+    """
+    key = (os.path.abspath(video_path), os.path.getmtime(video_path))
+    if key in _frame_indexes:
+        return _frame_indexes[key]
+
+    result = subprocess.run([
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        video_path
+    ], capture_output=True, text=True, check=True)
+
+    packets = []
+    for line in result.stdout.splitlines():
+        pts_time, flags = line.split(",")[:2]
+        if pts_time == "N/A":
+            continue
+        packets.append((float(pts_time), "K" in flags))
+
+    start_time = subprocess.run([
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=start_time',
+        '-of', 'csv=p=0',
+        video_path
+    ], capture_output=True, text=True, check=True).stdout.strip()
+    start_time = float(start_time) if start_time not in ("", "N/A") else 0.0
+
+    # Packets come in decode order, sorting by pts gives the frame numbers cv2 uses
+    packets.sort()
+    frame_times = [pts_time - start_time for pts_time, _ in packets]
+    keyframes = [frame_number for frame_number, (_, is_key) in enumerate(packets) if is_key]
+
+    _frame_indexes[key] = (frame_times, keyframes)
+    return frame_times, keyframes
+
+def get_keyframe_index(video_path) -> tuple[list[int], int]:
+    """Display order indices of the video's keyframes, plus the exact number of frames."""
+    frame_times, keyframes = get_frame_index(video_path)
+    return keyframes, len(frame_times)
@@ -1,10 +1,65 @@
-import csv
+import asyncio
+import math
 import os
+import shutil
+import tempfile
+import threading
+from functools import partial
+from typing import Callable, Optional
+import ffmpeg
 from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled, download_range_func
 from youtube_transcript_api import YouTubeTranscriptApi
 from urllib.parse import urlparse, parse_qs
+from artifact_cache import artifact_cache
+from clip_new import merge_media_files, smart_cut_segment
+from utils import TimeMap, get_frame_index, merge_intervals
+
+# Upper bounds for the blocking calls, in seconds. A multi-GB episode is rate limited to 2 MB/s.
+DOWNLOAD_TIMEOUT = 3 * 60 * 60
+SUBTITLES_TIMEOUT = 120
+INFO_TIMEOUT = 120
+# A channel with thousands of videos is listed a page of entries at a time
+LIST_TIMEOUT = 10 * 60
+
+VIDEO_FORMAT = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'  # Highest quality with audio
+
+# A section is cut to the frame by re-encoding it up to its first keyframe. Padding every interval by more
+# than YouTube's keyframe spacing keeps that re-encode out of the kept frames, they stay stream copied.
+KEYFRAME_PADDING_MS = 5000
+# Sections closer than this are fetched as one, a request costs more than a few seconds of video
+SECTION_MERGE_GAP_MS = 30000
+
+
+class ProgressStream:
+    """
+    yt-dlp progress dicts as an async iterator. hook runs on the download thread and hands every
+    update over to the event loop; iteration ends when the download does.
+    """
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+
+    def hook(self, d):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, d)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        d = await self._queue.get()
+        if d is None:
+            raise StopAsyncIteration
+        return d
+
 
 class VideoTools:
+    # Swapped for a fake in tests, anything with YoutubeDL's context manager, download and extract_info
+    downloader: Callable = YoutubeDL
+
     @staticmethod
     def progress_hook_yt(d):
         if d['status'] == 'downloading':
@@ -36,18 +91,47 @@ class VideoTools:
 
         return params['v'][0]
 
-    @classmethod
-    async def download_yt_video(cls, video_url: str, output_dir: str, file_name: str = "source_video.mp4") -> None:
-        output_file = os.path.join(output_dir, file_name)
+    @staticmethod
+    async def _run_blocking(func: Callable, timeout: float, cancelled: Optional[threading.Event] = None,
+                            on_abandoned: Optional[Callable] = None):
+        """
+        Runs func on the default executor. On timeout or cancellation cancelled is set, so a download
+        checking it stops at its next progress update instead of running on in the background.
+        The thread can't be stopped from here, so on_abandoned, like removing its temp files, only
+        runs once func has actually returned.
+        """
+        loop = asyncio.get_running_loop()
+        worker = loop.run_in_executor(None, func)
 
-        if(os.path.exists(output_file)):
-            return output_file
+        def stopped(future):
+            if not future.cancelled():
+                # Retrieved so it isn't reported as never retrieved, the caller already gave up on it
+                future.exception()
+            if on_abandoned is not None:
+                on_abandoned()
 
-        ydl_opts = {
-            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',  # Highest quality with audio
-            'outtmpl': output_file,
+        try:
+            # Shielded, so the wrapper future stays pending until the thread really returns
+            return await asyncio.wait_for(asyncio.shield(worker), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if cancelled is not None:
+                cancelled.set()
+            worker.add_done_callback(stopped)
+            raise
+
+    @staticmethod
+    def _download_opts(outtmpl: str, cancelled: threading.Event, progress: Optional[ProgressStream]) -> dict:
+        def hook(d):
+            if cancelled.is_set():
+                raise DownloadCancelled("download cancelled")
+            if progress is not None:
+                progress.hook(d)
+
+        return {
+            'format': VIDEO_FORMAT,
+            'outtmpl': outtmpl,
             'merge_output_format': 'mp4',
-            'progress_hooks': [cls.progress_hook_yt],
+            'progress_hooks': [hook],
             'quiet': False,
             'no_warnings': False,
             'ignoreerrors': False,
@@ -58,26 +142,139 @@ class VideoTools:
             'max_sleep_interval': 5,
             'external_downloader_args': ['--max-download-rate', '2M'],  # 
         }
-        
+
+    @classmethod
+    async def download_yt_video(cls, video_url: str, output_dir: str, file_name: str = "source_video.mp4",
+                                progress: Optional[ProgressStream] = None, timeout: float = DOWNLOAD_TIMEOUT) -> Optional[str]:
+        """
+        Downloads off the event loop. yt-dlp progress goes to progress, when given.
+        The video is downloaded into a job directory and only moved to output_file once complete,
+        so a download that timed out or was cancelled never leaves a file there.
+        """
+        output_file = os.path.join(output_dir, file_name)
+
+        cache_key = artifact_cache.key("video", {"video": cls.get_slug_from_yt_video_url(video_url), "format": VIDEO_FORMAT})
+        if artifact_cache.fetch(cache_key, output_file):
+            if progress is not None:
+                progress.close()
+            return output_file
+
+        cancelled = threading.Event()
+        job_dir = tempfile.mkdtemp(prefix="video_", dir=output_dir)
+        downloaded_file = os.path.join(job_dir, file_name)
+        ydl_opts = cls._download_opts(downloaded_file, cancelled, progress)
+
+        def download():
+            with cls.downloader(ydl_opts) as ydl:
+                ydl.download([video_url])
+
         try:
-            with YoutubeDL(ydl_opts) as ydl:
+            await cls._run_blocking(download, timeout, cancelled, on_abandoned=partial(shutil.rmtree, job_dir, ignore_errors=True))
+            os.replace(downloaded_file, output_file)
+            print(f"\nDownload completed successfully! Video saved at: {output_file}")
+            return artifact_cache.store(cache_key, output_file, regenerable=True)
+        except asyncio.TimeoutError:
+            print(f"Error downloading video: timed out after {timeout} s")
+        except Exception as e:
+            print("Error downloading video: ", e)
+        finally:
+            # A download that was given up on may still be writing, _run_blocking removes it once it stops
+            if not cancelled.is_set():
+                shutil.rmtree(job_dir, ignore_errors=True)
+            if progress is not None:
+                progress.close()
+
+    @classmethod
+    async def download_yt_sections(cls, video_url: str, output_dir: str, intervals: list[tuple[int, int]], file_name: str = "source_sections.mp4",
+                                   padding_ms: int = KEYFRAME_PADDING_MS, progress: Optional[ProgressStream] = None,
+                                   timeout: float = DOWNLOAD_TIMEOUT) -> Optional[tuple[str, TimeMap]]:
+        """
+        Downloads only the parts of the video around intervals, (start_ms, end_ms) of the source, as one file
+        of the padded sections back to back. Returns it with the TimeMap from source to file timestamps.
+        When the sections can't be fetched, like from a server without range requests, the whole video is
+        downloaded and mapped as is. None if that fails too.
+        """
+        sections = merge_intervals([(max(0, start - padding_ms), end + padding_ms) for start, end in intervals], SECTION_MERGE_GAP_MS)
+        output_file = os.path.join(output_dir, file_name)
+
+        cache_key = artifact_cache.key("video_sections", {"video": cls.get_slug_from_yt_video_url(video_url), "format": VIDEO_FORMAT, "sections": sections})
+        if artifact_cache.fetch(cache_key, output_file):
+            if progress is not None:
+                progress.close()
+            return output_file, TimeMap(sections)
+
+        cancelled = threading.Event()
+        job_dir = tempfile.mkdtemp(prefix="sections_", dir=output_dir)
+        ydl_opts = {
+            **cls._download_opts(os.path.join(job_dir, "section_%(section_start)d.%(ext)s"), cancelled, progress),
+            'download_ranges': download_range_func(None, [(start / 1000, end / 1000) for start, end in sections]),
+        }
+        # ffmpeg fetches the sections, and the rate limit is an option it doesn't know
+        ydl_opts.pop('external_downloader_args')
+        section_files = [os.path.join(job_dir, f"section_{start // 1000}.mp4") for start, _ in sections]
+        # Only moved to output_file by the event loop, once the worker finished in time
+        merged_file = os.path.join(job_dir, file_name)
+
+        def download():
+            with cls.downloader(ydl_opts) as ydl:
                 ydl.download([video_url])
-                print(f"\nDownload completed successfully! Video saved at: {output_file}")
-            return output_file
+            exact_files = []
+            for idx, ((start, end), section_file) in enumerate(zip(sections, section_files)):
+                # The progress hooks only see the fetch, the cuts check for a timeout or cancel themselves
+                if cancelled.is_set():
+                    raise DownloadCancelled("download cancelled")
+                # A downloader that can't seek ignores the range and fetches the whole video
+                duration_ms = float(ffmpeg.probe(section_file)["format"]["duration"]) * 1000
+                if duration_ms > end - start + padding_ms:
+                    raise RuntimeError(f"got {duration_ms / 1000:.0f} s for a {(end - start) / 1000:.0f} s section, ranges are not supported")
+                # A copied section carries the frames from the keyframe before its start, hidden by an edit list
+                # the concat demuxer ignores. Make them real frames, then cut from the exact frame, so the joined
+                # file matches TimeMap(sections).
+                frame_times, _ = get_frame_index(section_file)
+                preroll_ms = max(0, round(-frame_times[0] * 1000))
+                zeroed_file = os.path.join(job_dir, f"zeroed_{idx}.mp4")
+                ffmpeg.run(ffmpeg.output(ffmpeg.input(section_file), zeroed_file, c='copy', avoid_negative_ts='make_zero'),
+                           overwrite_output=True, capture_stdout=True, capture_stderr=True)
+                exact_files.append(smart_cut_segment(zeroed_file, os.path.join(job_dir, f"exact_{idx}.mp4"), preroll_ms, preroll_ms + end - start))
+            if cancelled.is_set():
+                raise DownloadCancelled("download cancelled")
+            merge_media_files(exact_files, merged_file)
+
+        try:
+            await cls._run_blocking(download, timeout, cancelled, on_abandoned=partial(shutil.rmtree, job_dir, ignore_errors=True))
+            os.replace(merged_file, output_file)
+            print(f"\nDownloaded {len(sections)} sections, saved at: {output_file}")
+            if progress is not None:
+                progress.close()
+            return artifact_cache.store(cache_key, output_file, regenerable=True), TimeMap(sections)
+        except asyncio.TimeoutError:
+            print(f"Error downloading sections: timed out after {timeout} s")
+            if progress is not None:
+                progress.close()
+            return None
         except Exception as e:
-            print(f"Error downloading video: ", e)
+            print("Error downloading sections, downloading the whole video instead: ", e)
+        finally:
+            if not cancelled.is_set():
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+        video_path = await cls.download_yt_video(video_url, output_dir, progress=progress, timeout=timeout)
+        if video_path is None:
+            return None
+        return video_path, TimeMap([(0, math.inf)])
 
     @classmethod
-    async def download_yt_subtitles(cls, video_url:str, output_dir:str, file_name:str = "subtitles.csv"):
+    async def download_yt_subtitles(cls, video_url:str, output_dir:str, file_name:str = "subtitles.csv", timeout: float = SUBTITLES_TIMEOUT):
         video_slug = cls.get_slug_from_yt_video_url(video_url)
 
         output_file = os.path.join(output_dir, file_name)
 
-        if(os.path.exists(output_file)):
+        cache_key = artifact_cache.key("subtitles", {"video": video_slug})
+        if artifact_cache.fetch(cache_key, output_file):
             return output_file
 
-        transcript = YouTubeTranscriptApi.get_transcript(video_slug)
         try:
+            transcript = await cls._run_blocking(lambda: YouTubeTranscriptApi.get_transcript(video_slug), timeout)
             with open(output_file, 'w', encoding='utf-8') as f:
                 f.write("text,startMs,endMs\n")
                 for track in transcript:
@@ -85,49 +282,71 @@ class VideoTools:
                     durationMs = int(1000*float(track["duration"]))
                     endMs = startMs+durationMs
                     f.write(f"{track['text']},{startMs},{endMs}\n")
-            return output_file
+            return artifact_cache.store(cache_key, output_file)
         except Exception as e:
-            print(f"Error downloading subtitles: ", e)
+            print("Error downloading subtitles: ", e)
 
-    async def get_video_info(url):
+    @classmethod
+    async def get_video_info(cls, url, timeout: float = INFO_TIMEOUT):
         ydl_opts = {
             'quiet': True,
             'no_warnings': True,
             'extract_flat': True
         }
+
+        def extract_info():
+            with cls.downloader(ydl_opts) as ydl:
+                return ydl.extract_info(url, download=False)
         
         try:
-            with YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                video_details = {
-                    'title': info.get('title'),
-                    'description': info.get('description'),
-                    'duration': info.get('duration'),  # in seconds
-                    'view_count': info.get('view_count'),
-                    'like_count': info.get('like_count'),
-                    'upload_date': info.get('upload_date'),
-                    'channel': info.get('uploader'),
-                    'channel_url': info.get('uploader_url')
-                }
-                
-                return video_details
+            info = await cls._run_blocking(extract_info, timeout)
+            
+            video_details = {
+                'id': info.get('id'),
+                'title': info.get('title'),
+                'description': info.get('description'),
+                'duration': info.get('duration'),  # in seconds
+                'view_count': info.get('view_count'),
+                'like_count': info.get('like_count'),
+                'upload_date': info.get('upload_date'),
+                'channel': info.get('uploader'),
+                'channel_url': info.get('uploader_url')
+            }
+            
+            return video_details
                 
         except Exception as e:
-            print(f"Error downloading video info: ", e)
+            print("Error downloading video info: ", e)
+
+    @classmethod
+    async def get_playlist_entries(cls, url: str, timeout: float = LIST_TIMEOUT) -> Optional[list[dict]]:
+        """
+        id and url of every video of a playlist or channel, from flat extraction: one listing request per
+        page of entries, no request per video. A channel's tabs (videos, shorts, live) are listed in turn.
+        """
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'extract_flat': 'in_playlist'
+        }
 
-# def download_save_video_info(urls: list[str]):
-#     csv_store = "processed_data/metadata_temp/data.csv"
+        def list_entries():
+            # By id, a stream shows up under both the videos and the live tab
+            entries = {}
+            with cls.downloader(ydl_opts) as ydl:
+                pending = [url]
+                while pending:
+                    info = ydl.extract_info(pending.pop(0), download=False)
+                    for entry in info.get('entries') or []:
+                        if entry is None:
+                            continue
+                        if entry.get('ie_key') == 'YoutubeTab':
+                            pending.append(entry['url'])
+                        else:
+                            entries.setdefault(entry['id'], {'id': entry['id'], 'url': entry.get('url') or f"https://www.youtube.com/watch?v={entry['id']}"})
+            return list(entries.values())
 
-#     video_details = []
-#     for url in urls:
-#         video_details.append(get_video_info(url))
-    
-#     with open(csv_store, "w", encoding="utf-8") as file:
-#         csv_writer = csv.DictWriter(file,video_details[0].keys())
-#         csv_writer.writeheader()
-#         for vd in video_details:
-#             if not vd:
-#                 continue
-#             csv_writer.writerow(vd)
-    
\ No newline at end of file
+        try:
+            return await cls._run_blocking(list_entries, timeout)
+        except Exception as e:
+            print(f"Error listing {url}: ", e)